@@ -0,0 +1,69 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+# #########################################################################
+# Change log
+# #########################################################################
+# Bounded ring buffer of the broadcast change notifications
+# - every notification gets the next sequence number
+# - a reconnecting client gets the notifications after its last sequence number (see since)
+# - the sequence numbers start at the start time (ms), the numbers of an earlier
+#   server process are older than the log and cannot be mixed with the current ones
+# =========================================================================
+class ChangeLog:
+    # Number of the stored notifications
+    # TODO - can be set to the desired value
+    #  (with NOTIFY_WINDOW = 0.5 sec 1024 notifications are at least ~8.5 minutes)
+    MAX_ENTRIES = 1024
+
+    # =========================================================================
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.__lock = Lock()
+        self.__entries = deque(maxlen=max_entries)
+        self.__seq = int(time.time() * 1000)
+        # the oldest sequence number which can be resumed
+        self.__first_seq = self.__seq
+
+    # =========================================================================
+    # append(changes, seq) -> int
+    # =========================================================================
+    # - seq: the sequence number given by an other log (see server_workers.py), otherwise the next one
+    # =========================================================================
+    def append(self, changes, seq=None):
+        with self.__lock:
+            self.__seq = self.__seq + 1 if seq is None else max(seq, self.__seq)
+            if len(self.__entries) == self.__entries.maxlen:
+                # the oldest entry is dropped
+                self.__first_seq = self.__entries[0][0]
+            self.__entries.append((self.__seq, changes))
+            return self.__seq
+
+    # =========================================================================
+    # reset(seq)
+    # =========================================================================
+    # - drops every notification, the numbering continues from seq
+    # =========================================================================
+    def reset(self, seq):
+        with self.__lock:
+            self.__entries.clear()
+            self.__seq = seq
+            self.__first_seq = seq
+
+    # =========================================================================
+    def last_seq(self):
+        with self.__lock:
+            return self.__seq
+
+    # =========================================================================
+    # since(seq) -> (last seq, [changes, ...] or None)
+    # =========================================================================
+    # - the notifications after seq (oldest first)
+    # - None if the notifications after seq are not stored (any more)
+    # =========================================================================
+    def since(self, seq):
+        with self.__lock:
+            if seq < self.__first_seq or seq > self.__seq:
+                return self.__seq, None
+            return self.__seq, [changes for entry_seq, changes in self.__entries if entry_seq > seq]
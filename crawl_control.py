@@ -0,0 +1,106 @@
+# #########################################################################
+# Crawl control
+# #########################################################################
+# Adaptive page size and in-flight page limit for the WordPress GETs
+# - the observed latencies and responses of a loop are evaluated by update()
+# - throttled responses (429/503) halve the in-flight pages
+# - too many errors (5xx, IO errors) halve the in-flight pages and the page size
+# - slow pages (above TARGET_LATENCY) halve the page size
+# - fast and error-free loops double the page size and add one in-flight page
+# =========================================================================
+class CrawlController:
+    # Latency of the page GETs (~90th percentile of a loop)
+    # TODO - can be set to the desired value (seconds)
+    TARGET_LATENCY = 2.0  # sec
+    # Maximal error rate of a loop (failed pages / all pages)
+    ERROR_RATE_LIMIT = 0.1
+    # Status codes of the throttled responses
+    THROTTLED = (429, 503)
+
+    # =========================================================================
+    def __init__(self, per_page, in_flight, max_per_page=100, max_in_flight=32, adaptive=True):
+        self.__per_page = per_page
+        self.__in_flight = in_flight
+        self.__max_per_page = max_per_page
+        self.__max_in_flight = max_in_flight
+        self.__adaptive = adaptive
+        # observations of the current loop
+        self.__latencies = list()
+        self.__pages = 0
+        self.__throttled = 0
+        self.__errors = 0
+        # last decision
+        self.__state = {'reason': 'initial', 'latency': None, 'error_rate': 0.0}
+
+    # =========================================================================
+    def per_page(self): return self.__per_page
+    def in_flight(self): return self.__in_flight
+
+    # =========================================================================
+    # observe(latency, status_code)
+    # =========================================================================
+    # - latency: seconds (None if no response was received)
+    # - status_code: HTTP status (None if no response was received)
+    # =========================================================================
+    def observe(self, latency, status_code):
+        self.__pages += 1
+        if status_code is None:
+            self.__errors += 1
+        elif status_code in CrawlController.THROTTLED:
+            self.__throttled += 1
+        elif status_code >= 500:
+            self.__errors += 1
+        elif latency is not None:
+            self.__latencies.append(latency)
+
+    # =========================================================================
+    # update() -> bool
+    # =========================================================================
+    # - evaluates the observations of the loop
+    # - returns True if the page size was changed
+    # =========================================================================
+    def update(self):
+        pages = self.__pages
+        if pages == 0:
+            return False
+
+        per_page = self.__per_page
+        error_rate = (self.__throttled + self.__errors) / pages
+        latency = None
+        if self.__latencies:
+            latencies = sorted(self.__latencies)
+            latency = latencies[int(0.9 * (len(latencies) - 1))]
+
+        if not self.__adaptive:
+            reason = 'fixed'
+        elif self.__throttled:
+            reason = 'throttled'
+            self.__in_flight = max(self.__in_flight // 2, 1)
+        elif error_rate > CrawlController.ERROR_RATE_LIMIT:
+            reason = 'errors'
+            self.__in_flight = max(self.__in_flight // 2, 1)
+            self.__per_page = max(self.__per_page // 2, 1)
+        elif latency is not None and latency > CrawlController.TARGET_LATENCY:
+            reason = 'slow'
+            self.__per_page = max(self.__per_page // 2, 1)
+        elif latency is not None and latency < CrawlController.TARGET_LATENCY / 2:
+            reason = 'fast'
+            self.__per_page = min(self.__per_page * 2, self.__max_per_page)
+            self.__in_flight = min(self.__in_flight + 1, self.__max_in_flight)
+        else:
+            reason = 'hold'
+
+        self.__state = {'reason': reason, 'latency': latency, 'error_rate': error_rate}
+        self.__latencies.clear()
+        self.__pages = 0
+        self.__throttled = 0
+        self.__errors = 0
+        return per_page != self.__per_page
+
+    # =========================================================================
+    # state() -> dict
+    # =========================================================================
+    # current decisions (for monitoring)
+    # =========================================================================
+    def state(self):
+        return dict(self.__state, per_page=self.__per_page, in_flight=self.__in_flight)
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# aiohttp is optional, it is needed only by the AsyncHttpFetcher
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Transport errors of the fetchers (the aiohttp errors are not IOError-s, except ClientOSError)
+FETCH_ERRORS = (IOError, aiohttp.ClientError) if aiohttp is not None else (IOError,)
+
+
+# #########################################################################
+# HTTP I/O
+# #########################################################################
+
+# =========================================================================
+# host_of(url) -> string
+# =========================================================================
+def host_of(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+# =========================================================================
+# class HttpResponse
+# =========================================================================
+# Minimal response object for the async fetcher
+# (it has the same attributes as requests.Response, which are used by the callers)
+# =========================================================================
+class HttpResponse:
+
+    # =========================================================================
+    def __init__(self, status_code, reason, headers, content, elapsed):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        # time until the response headers were received
+        self.elapsed = elapsed
+
+    # =========================================================================
+    def json(self):
+        return json.loads(self.content)
+
+
+# =========================================================================
+# class ResponseCache
+# =========================================================================
+# Conditional GET cache (ETag / Last-Modified)
+# - the entries are stored with a key (e.g. the query string of the request)
+# - request_headers(key) returns the If-None-Match / If-Modified-Since headers
+# - by a 304 response not_modified(key) returns the stored value
+# - the least recently used entries are dropped above max_entries
+# =========================================================================
+class ResponseCache:
+    MAX_ENTRIES = 1024
+
+    # =========================================================================
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.__lock = Lock()
+        self.__max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__bytes_saved = 0
+
+    # =========================================================================
+    # validators(response) -> dict or None
+    # =========================================================================
+    @staticmethod
+    def validators(response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return None
+        return {'etag': etag, 'last_modified': last_modified, 'size': len(response.content)}
+
+    # =========================================================================
+    def request_headers(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        headers = dict()
+        if entry['etag'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified'] is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    # =========================================================================
+    def store(self, key, validators, value):
+        if validators is None:
+            return
+        with self.__lock:
+            self.__entries[key] = dict(validators, value=value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+    # =========================================================================
+    # not_modified(key) -> (True, value) or (False, None)
+    # =========================================================================
+    def not_modified(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                # the entry was dropped in the meantime
+                return False, None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            self.__bytes_saved += entry['size']
+            return True, entry['value']
+
+    # =========================================================================
+    def modified(self, key):
+        with self.__lock:
+            self.__misses += 1
+            self.__entries.pop(key, None)
+
+    # =========================================================================
+    def stats(self):
+        with self.__lock:
+            return {'entries': len(self.__entries),
+                    'hits': self.__hits,
+                    'misses': self.__misses,
+                    'bytes_saved': self.__bytes_saved}
+
+
+# =========================================================================
+# Connection counting
+# =========================================================================
+# urllib3 reconnects silently on the same connection object if the server has closed
+# the socket (HTTP/1.0, 'Connection: close', keep-alive timeout), therefore the
+# connection objects of the pool (num_connections) are not the TCP connects.
+# The connects are counted by the connections, in the pool which created them.
+# =========================================================================
+connect_lock = Lock()
+
+
+class CountingHTTPConnection(HTTPConnection):
+    counting_pool = None
+
+    def connect(self):
+        super().connect()
+        if self.counting_pool is not None:
+            with connect_lock:
+                self.counting_pool.num_connects += 1
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    counting_pool = None
+
+    def connect(self):
+        super().connect()
+        if self.counting_pool is not None:
+            with connect_lock:
+                self.counting_pool.num_connects += 1
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+    num_connects = 0
+
+    def _new_conn(self):
+        connection = super()._new_conn()
+        connection.counting_pool = self
+        return connection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+    num_connects = 0
+
+    def _new_conn(self):
+        connection = super()._new_conn()
+        connection.counting_pool = self
+        return connection
+
+
+# =========================================================================
+# class CountingHTTPAdapter
+# =========================================================================
+# HTTPAdapter with the connection counting pools
+# =========================================================================
+class CountingHTTPAdapter(HTTPAdapter):
+
+    # =========================================================================
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                                   'https': CountingHTTPSConnectionPool}
+
+
+# =========================================================================
+# class HttpFetcher
+# =========================================================================
+# Shared, thread-safe keep-alive connection pool (based on requests.Session)
+# - the connections are reused between the pages and the loops
+# - the pool can be sized per host (see set_pool_size)
+# - the connection reuse counts are available with stats()
+# =========================================================================
+class HttpFetcher:
+    # Kept-alive connections per host
+    # TODO - should be at least the number of threads which use the fetcher
+    #  (As default we have  4 + CPU-logical-cores  threads in the pool)
+    POOL_MAXSIZE = 32
+
+    # =========================================================================
+    def __init__(self, headers=None, pool_maxsize=POOL_MAXSIZE, timeout=None):
+        self.__lock = Lock()
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        if headers is not None:
+            self.__session.headers.update(headers)
+        # the default adapter is used for the hosts without own pool size
+        self.__adapters = {}
+        self.__default_adapter = CountingHTTPAdapter(pool_maxsize=pool_maxsize)
+        self.__session.mount('http://', self.__default_adapter)
+        self.__session.mount('https://', self.__default_adapter)
+
+    # =========================================================================
+    def set_pool_size(self, url, pool_maxsize):
+        host = host_of(url)
+        with self.__lock:
+            adapter = CountingHTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+            self.__adapters[host] = adapter
+            self.__session.mount(host, adapter)
+
+    # =========================================================================
+    def get(self, url, headers=None):
+        return self.__session.get(url, headers=headers, timeout=self.__timeout)
+
+    # =========================================================================
+    # stats() -> dict
+    # =========================================================================
+    # {'https://host': {'requests': n, 'connections': m, 'reused': n - m}, ...}
+    # - connections: the TCP connects (also the reconnects, see CountingHTTPConnection)
+    # =========================================================================
+    def stats(self):
+        result = dict()
+        with self.__lock:
+            adapters = [self.__default_adapter] + list(self.__adapters.values())
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f'{pool.scheme}://{pool.host}:{pool.port}'
+                host_stats = result.setdefault(host, {'requests': 0, 'connections': 0, 'reused': 0})
+                host_stats['requests'] += pool.num_requests
+                with connect_lock:
+                    connects = pool.num_connects
+                host_stats['connections'] += connects
+                host_stats['reused'] += max(pool.num_requests - connects, 0)
+        return result
+
+    # =========================================================================
+    def close(self):
+        self.__session.close()
+
+
+# =========================================================================
+# class AsyncHttpFetcher
+# =========================================================================
+# asyncio variant of the HttpFetcher (needs aiohttp)
+# - one thread can keep many GETs in flight (see get_many)
+# - the connections are reused between the calls of get_many
+# =========================================================================
+class AsyncHttpFetcher:
+    # Maximal number of connections per host
+    LIMIT_PER_HOST = 32
+
+    # =========================================================================
+    def __init__(self, headers=None, limit_per_host=LIMIT_PER_HOST, timeout=None):
+        if aiohttp is None:
+            raise RuntimeError('AsyncHttpFetcher: aiohttp is not installed')
+        self.__headers = dict(headers) if headers is not None else dict()
+        self.__limit_per_host = limit_per_host
+        self.__timeout = timeout
+        self.__loop = asyncio.new_event_loop()
+        self.__session = None
+        self.__stats = dict()
+
+    # =========================================================================
+    def __count(self, url, key):
+        host_stats = self.__stats.setdefault(host_of(str(url)), {'requests': 0, 'connections': 0, 'reused': 0})
+        host_stats[key] += 1
+
+    # =========================================================================
+    async def __on_request_start(self, session, context, params):
+        self.__count(params.url, 'requests')
+
+    # =========================================================================
+    async def __on_connection_create_end(self, session, context, params):
+        self.__count(context.trace_request_ctx, 'connections')
+
+    # =========================================================================
+    async def __on_connection_reuseconn(self, session, context, params):
+        self.__count(context.trace_request_ctx, 'reused')
+
+    # =========================================================================
+    def __create_session(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self.__on_request_start)
+        trace_config.on_connection_create_end.append(self.__on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self.__on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.__limit_per_host)
+        timeout = aiohttp.ClientTimeout(total=self.__timeout)
+        return aiohttp.ClientSession(headers=self.__headers, connector=connector, timeout=timeout,
+                                     trace_configs=[trace_config])
+
+    # =========================================================================
+    async def __get(self, url, headers):
+        # the url is passed as trace context to count the connections per host
+        start = time.perf_counter()
+        async with self.__session.get(url, headers=headers, trace_request_ctx=url) as response:
+            elapsed = timedelta(seconds=time.perf_counter() - start)
+            content = await response.read()
+            return HttpResponse(response.status, response.reason, response.headers, content, elapsed)
+
+    # =========================================================================
+    async def __get_many(self, urls, headers_list):
+        if self.__session is None:
+            self.__session = self.__create_session()
+        return await asyncio.gather(*[self.__get(url, headers) for url, headers in zip(urls, headers_list)],
+                                    return_exceptions=True)
+
+    # =========================================================================
+    # get_many([url, ...], [headers, ...]) -> [HttpResponse or Exception, ...]
+    # =========================================================================
+    # - should be called always from the same thread
+    # - headers_list contains the extra headers for every url (or None)
+    # =========================================================================
+    def get_many(self, urls, headers_list=None):
+        if headers_list is None:
+            headers_list = [None] * len(urls)
+        return self.__loop.run_until_complete(self.__get_many(urls, headers_list))
+
+    # =========================================================================
+    def stats(self):
+        return {host: dict(host_stats) for host, host_stats in self.__stats.items()}
+
+    # =========================================================================
+    def close(self):
+        if self.__session is not None:
+            self.__loop.run_until_complete(self.__session.close())
+            self.__session = None
+        self.__loop.close()
@@ -1,11 +1,38 @@
 import concurrent.futures
+import time
 from time import sleep
 
 import wordpress_io as wp_io
 import protocol_io as p_io
 
 
-from performance_timer import PerformanceTimer
+from performance_timer import metrics
+from poll_scheduler import PollScheduler
+from server_workers import UpdatePublisher, start_workers
+from snapshot_store import SnapshotStore
+
+# Poll intervals (see poll_scheduler.py)
+# TODO - can be set to the desired values (seconds)
+#  after changes the next poll comes after MIN_POLL_INTERVAL,
+#  without changes the interval is doubled until wp_io.UPDATE_PERIOD
+MIN_POLL_INTERVAL = 1.0  # sec
+# Maximal average GET rate (requests/sec)
+MAX_REQUEST_RATE = 20.0
+
+# Snapshot of the posts and of the crawl cursor for warm restarts (see snapshot_store.py)
+# TODO - can be set to the desired file (None: no snapshot) and period (seconds)
+SNAPSHOT_FILE = 'posts_snapshot.sqlite'
+SNAPSHOT_PERIOD = 60.0  # sec
+
+# Websocket server processes (see server_workers.py)
+# TODO - can be set to the desired value between 0 .. n
+#  0: the websocket server runs in the main process
+#  n: n worker processes serve the clients on the same port, the main process runs only the crawler
+WEBSOCKET_WORKERS = 0
+
+# Period of the metrics dump (see performance_timer.py, the metrics are also returned by the 'stats' request)
+# TODO - can be set to the desired value (seconds, None: no dump)
+METRICS_PERIOD = 60.0  # sec
 
 
 # #########################################################################
@@ -13,31 +40,66 @@ from performance_timer import PerformanceTimer
 # #########################################################################
 def main_loop():
     print('Wordpress client is running')
+    scheduler = PollScheduler(MIN_POLL_INTERVAL, wp_io.UPDATE_PERIOD, MAX_REQUEST_RATE)
+    snapshot = None
+    snapshot_time = time.monotonic()
+    metrics_time = time.monotonic()
+    if SNAPSHOT_FILE is not None:
+        # restore the posts and continue the crawl from the stored cursor
+        snapshot = SnapshotStore(SNAPSHOT_FILE)
+        cursor = snapshot.load()
+        if cursor is not None:
+            wp_io.restore_cursor(cursor)
+        print(f'snapshot: {p_io.protocol_object.get_post_count()} posts restored, cursor: {cursor}')
     with concurrent.futures.ThreadPoolExecutor() as executor:
         while True:
             # time-measurement start
-            wp_client_pt = PerformanceTimer("wp_client")
+            wp_client_pt = metrics.timer("wp_client")
             wp_client_pt.start()
             # Call WordPress client
-            wp_io.client(executor)
+            summary = wp_io.client(executor)
             # time-measurement end
             wp_client_pt.print_duration(True)
 
             # Broadcast (new/changed/deleted items)...
             p_io.protocol_object.notify_clients()
 
-            # If every post received then go to sleep (see UPDATE_PERIOD, default is ~10 sec)
-            # otherwise sleep 0.1 sec
-            if wp_io.is_ready():
-                sleep(wp_io.UPDATE_PERIOD)
-            else:
-                sleep(0.1)
+            # If every post received then go to sleep
+            # (between MIN_POLL_INTERVAL and UPDATE_PERIOD, depending on the changes)
+            # otherwise sleep ~0.1 sec
+            for latency in summary['latencies']:
+                scheduler.record_latency(latency)
+            delay = scheduler.next_delay(wp_io.is_ready(), summary['changes'], summary['requests'],
+                                         wp_client_pt.duration())
+            print('scheduler      ', scheduler.state())
+            print('answer cache   ', p_io.protocol_object.get_cache_stats())
+            print('client queues  ', p_io.protocol_object.get_queue_stats())
+            print('requests       ', p_io.protocol_object.get_request_stats())
+            print('wire encoding  ', p_io.protocol_object.get_encoding_stats())
+
+            # Save the changes since the last snapshot
+            if snapshot is not None and time.monotonic() - snapshot_time >= SNAPSHOT_PERIOD:
+                snapshot_time = time.monotonic()
+                with metrics.timer('snapshot.save'):
+                    print('snapshot       ', snapshot.save(wp_io.crawl_cursor()))
+            if METRICS_PERIOD is not None and time.monotonic() - metrics_time >= METRICS_PERIOD:
+                metrics_time = time.monotonic()
+                metrics.dump()
+            sleep(delay)
 
 
 # #########################################################################
 # main
 # #########################################################################
 def main():
+    workers = list()
+    if WEBSOCKET_WORKERS > 0:
+        # the workers are started before any thread of the crawler
+        print(f'start {WEBSOCKET_WORKERS} websocket workers...')
+        publisher = UpdatePublisher()
+        p_io.protocol_object.set_publisher(publisher)
+        workers = start_workers(WEBSOCKET_WORKERS, publisher)
+
     print('start wordpress client...')
     # submit the 'mail_loop' task to the thread pool and get a future object
     with concurrent.futures.ThreadPoolExecutor(1) as executor:
@@ -50,9 +112,13 @@ def main():
             print('wordpress client could not start')
             exit(-1)
 
-        print('start websocket server...')
-        # Start the WS server and loop forever
-        p_io.protocol_object.infinite_io_loop()
+        if workers:
+            # the clients are served by the workers
+            future.result()
+        else:
+            print('start websocket server...')
+            # Start the WS server and loop forever
+            p_io.protocol_object.infinite_io_loop()
 
 
 # =========================================================================
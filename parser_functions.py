@@ -1,12 +1,27 @@
 
 import re
-from bs4 import BeautifulSoup
+import time
+import hashlib
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
+from html.parser import HTMLParser
 
 
 # #########################################################################
 # Parse functions
 # #########################################################################
 pattern = re.compile('^[^A-ZÄÖÜa-zäöüß]+|[^A-ZÄÖÜa-zäöüß\-:0-9.]*|[^A-ZÄÖÜa-zäöüß.]+$')
+# the inner '.' (z.B., u.a. ...)
+inner_dot_pattern = re.compile(r'^.+\..+')
+# the fragments of the filtered word (hyphen rules)
+fragment_pattern = re.compile(r'[A-ZÄÖÜa-zäöüß\:0-9.]+[A-ZÄÖÜa-zäöüß\:0-9.]+-|[A-ZÄÖÜa-zäöüß\:0-9.-]*')
+# simple words, which need no filtering at all
+simple_word_pattern = re.compile('[a-zäöüß]+')
+
+# Size of the LRU memo for the normalized tokens
+# TODO - can be set to the desired value between 0 .. n (None: unlimited)
+TOKEN_CACHE_SIZE = 65536
 
 
 # =========================================================================
@@ -20,70 +35,228 @@ def filter_text(text):
 
 
 # =========================================================================
-# filter_word(string) -> [string]
+# normalize_token(string) -> (string, ...)
 # =========================================================================
-def filter_word(word):
-    word = word.lower()
+# - normalizes one whitespace-separated token (same rules as filter_word)
+# - the results are memoized, the repeated tokens cost only a lookup
+# =========================================================================
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def normalize_token(token):
+    word = token.lower()
+    # most of the tokens are simple words
+    if simple_word_pattern.fullmatch(word):
+        return word,
+
     filtered_word = pattern.sub('', word)
 
     # if we have '.' in the word (z.B., u.a. ...), we do not remove the '.' at end
     # otherwise the '.' will be removed
-    if not re.search(r'^.+\..+', filtered_word):
-        if filtered_word.endswith('.'):
-            filtered_word = filtered_word[:-1]
+    if filtered_word.endswith('.') and not inner_dot_pattern.search(filtered_word):
+        filtered_word = filtered_word[:-1]
+
+    # remove the '-' at the end of the fragments
+    return tuple(fragment[:-1] if fragment.endswith('-') else fragment
+                 for fragment in fragment_pattern.findall(filtered_word) if fragment != '' and fragment != '-')
 
-    filtered_words = re.findall(r'[A-ZÄÖÜa-zäöüß\:0-9.]+[A-ZÄÖÜa-zäöüß\:0-9.]+-|[A-ZÄÖÜa-zäöüß\:0-9.-]*', filtered_word)
-    filtered_words = list(filter(None, map(lambda c: re.sub(r'-$', '', c), filtered_words)))
 
-    return filtered_words
+# =========================================================================
+# filter_word(string) -> [string]
+# =========================================================================
+def filter_word(word):
+    return list(normalize_token(word))
+
+
+# =========================================================================
+# class WordCounter
+# =========================================================================
+# Counts the normalized words of the fed text(s) in one pass
+# - the time spent in the tokenization is summed (see parse_json timings)
+# =========================================================================
+class WordCounter:
+
+    # =========================================================================
+    def __init__(self):
+        self.__counts = Counter()
+        self.__feed_time = 0.0
+
+    # =========================================================================
+    def feed(self, text):
+        start = time.perf_counter()
+        self.__counts.update(chain.from_iterable(map(normalize_token, text.split())))
+        self.__feed_time += time.perf_counter() - start
+
+    # =========================================================================
+    def feed_time(self):
+        return self.__feed_time
+
+    # =========================================================================
+    # words() -> [(word, count), ...] sorted by word
+    # =========================================================================
+    def words(self):
+        return sorted(self.__counts.items(), key=lambda x: x[0])
+
+
+# =========================================================================
+# class TextExtractor
+# =========================================================================
+# Streaming HTML to text extraction (without tree building)
+# - the content of script/style tags is skipped
+# - every other tag separates the strings, except the inline fragments like
+#   <b>I</b><span style="font-weight: 300;">ntegration  -->  Integration
+#   <strong>V</strong>olatility                         -->  Volatility
+#   (<strong> and </strong> are ignored, <span ...> is handled as <b> and
+#   a </b> which is directly followed by a <b> does not separate the strings)
+# - the tag names are case-insensitive (html.parser), <SPAN>I</SPAN><SPAN>ntegration</SPAN>
+#   is joined too (the original regex rewrite handled only the lowercase tags)
+# - the finished strings are fed into the word counter in batches
+#   (at least FEED_SIZE characters)
+# =========================================================================
+class TextExtractor(HTMLParser):
+    SKIPPED_TAGS = ('script', 'style')
+    FEED_SIZE = 4096
+
+    # =========================================================================
+    def __init__(self, word_counter):
+        super().__init__(convert_charrefs=True)
+        self.__word_counter = word_counter
+        # fragments of the current string
+        self.__fragments = list()
+        # finished (stripped) strings
+        self.__strings = list()
+        # first string and length of the next batch for the word counter
+        self.__feed_index = 0
+        self.__feed_length = 0
+        self.__skipped_tag = None
+        # a </b> was received, it separates the strings only if no <b> follows
+        self.__pending_end = False
+
+    # =========================================================================
+    def __end_string(self):
+        self.__pending_end = False
+        if self.__fragments:
+            string = ''.join(self.__fragments).strip()
+            self.__fragments.clear()
+            if string:
+                self.__strings.append(string)
+                self.__feed_length += len(string)
+                if self.__feed_length >= TextExtractor.FEED_SIZE:
+                    self.__feed()
+
+    # =========================================================================
+    def __feed(self):
+        if self.__feed_index < len(self.__strings):
+            self.__word_counter.feed(' '.join(self.__strings[self.__feed_index:]))
+            self.__feed_index = len(self.__strings)
+            self.__feed_length = 0
+
+    # =========================================================================
+    def updatepos(self, i, j):
+        # the line numbers are not needed (faster without them)
+        return j
+
+    # =========================================================================
+    def handle_starttag(self, tag, attrs):
+        if tag == 'strong' and self.get_starttag_text() == '<strong>':
+            return
+        if self.__pending_end and (tag == 'span' or self.get_starttag_text() == '<b>'):
+            # </b><b> --> the fragments belong to the same string
+            self.__pending_end = False
+            return
+        self.__end_string()
+        if tag in TextExtractor.SKIPPED_TAGS:
+            self.__skipped_tag = tag
+
+    # =========================================================================
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        # <span .../> is handled as <b>
+        if tag != 'span':
+            self.handle_endtag(tag)
+
+    # =========================================================================
+    def handle_endtag(self, tag):
+        if tag == 'strong':
+            return
+        if self.__pending_end:
+            self.__end_string()
+        if tag == 'b' or tag == 'span':
+            self.__pending_end = True
+            return
+        self.__end_string()
+        if tag == self.__skipped_tag:
+            self.__skipped_tag = None
+
+    # =========================================================================
+    def handle_data(self, data):
+        if self.__pending_end:
+            self.__end_string()
+        if self.__skipped_tag is None:
+            self.__fragments.append(data)
+
+    # =========================================================================
+    def handle_comment(self, data):
+        self.__end_string()
+
+    # =========================================================================
+    def handle_decl(self, decl):
+        self.__end_string()
+
+    # =========================================================================
+    def handle_pi(self, data):
+        self.__end_string()
+
+    # =========================================================================
+    def unknown_decl(self, data):
+        self.__end_string()
+        # the content of CDATA sections is a separate string
+        if data.upper().startswith('CDATA['):
+            self.__fragments.append(data[len('CDATA['):])
+            self.__end_string()
+
+    # =========================================================================
+    def close(self):
+        super().close()
+        self.__end_string()
+        self.__feed()
+
+    # =========================================================================
+    def strings(self):
+        return self.__strings
+
+
+# =========================================================================
+# content_hash(string) -> string
+# =========================================================================
+# - hash of the rendered content, to detect the unchanged contents without parse
+# =========================================================================
+def content_hash(entry_content):
+    return hashlib.blake2b(entry_content.encode('utf-8'), digest_size=16).hexdigest()
 
 
 # =========================================================================
 # parse_json(json) -> dict
 # =========================================================================
+# - timings: {'extract': sec, 'tokenize': sec, 'sort': sec}
+#   (the parse can run in an other process, the caller records them, see parser_pool.py)
+# =========================================================================
 def parse_json(entry_content):
-    # Currently regexp is used to fix entries like
-    # <b>I</b><span style="font-weight: 300;">ntegration  -->  Integration
-    # <strong>V</strong>olatility                         -->  Volatility
-    # TODO: search a solution with soup instead of regexp
-    entry_content = re.sub(r'<strong>|</strong>', '', entry_content)
-    entry_content = re.sub(r'<span.*?>', '<b>', entry_content)
-    entry_content = re.sub(r'</span>', '</b>', entry_content)
-    entry_content = re.sub(r'</b><b>', '', entry_content)
-    soup = BeautifulSoup(entry_content, features='html.parser')
-
-    for data in soup(['style', 'script']):
-        # Remove tags
-        data.decompose()
-
-    entry_text = ' '.join(soup.stripped_strings)
-    entry_words = entry_text.split()
-
-    string_dict = dict()
-    for word in entry_words:
-        # remove not allowed characters
-        words = filter_word(word)
-
-        for filtered_word in words:
-            # create or update entry in count map
-            if len(filtered_word) > 0:
-                # Count the existing/new words
-                value_from_map = string_dict.get(filtered_word)
-                if value_from_map is None:
-                    string_dict[filtered_word] = 1
-                else:
-                    string_dict[filtered_word] = value_from_map + 1
-
-    # Sorting the map by key
-    sorted_string_list = sorted(string_dict.items(), key=lambda x: x[0])
+    # Extract the text and count the words (sorted by key)
+    # - the extracted strings are counted during the parse (see TextExtractor)
+    start = time.perf_counter()
+    word_counter = WordCounter()
+    text_extractor = TextExtractor(word_counter)
+    text_extractor.feed(entry_content)
+    text_extractor.close()
+    parsed = time.perf_counter()
+    sorted_string_list = word_counter.words()
+    timings = {'extract': parsed - start - word_counter.feed_time(), 'tokenize': word_counter.feed_time(),
+               'sort': time.perf_counter() - parsed}
 
     print('LIST ', sorted_string_list)
 
-    # sorted_string_dict = dict(sorted_string_list)
-    #print('DICT ', sorted_string_dict)
-
     # store the content for possible manual checks
+    entry_text = ' '.join(text_extractor.strings())
     entry_text = entry_text.replace("\n\n", "\n")
     entry_text = entry_text.replace("\t", " ")
 
-    return {'words': sorted_string_list, 'content': entry_text}
+    return {'words': sorted_string_list, 'content': entry_text, 'timings': timings}
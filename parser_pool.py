@@ -0,0 +1,144 @@
+import concurrent.futures
+import multiprocessing
+from array import array
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import parser_functions as parser
+from performance_timer import metrics
+
+
+# #########################################################################
+# Parser pool
+# #########################################################################
+# The parser is pure python and CPU-bound (the GIL serializes the threads),
+# therefore the posts are parsed by a process pool.
+# - the fetch threads feed the pool with the raw 'content.rendered' strings
+# - the processes return compact word-count payloads (see pack_words)
+# - the parse timings are returned too, they are recorded in the caller process
+#   (the metrics of the pool processes are not visible to the server)
+# =========================================================================
+
+# =========================================================================
+# pack_words([(word, count), ...]) -> (string, bytes)
+# =========================================================================
+# - the words are joined with '\n' (a word never contains whitespace)
+# - the counts are stored as an unsigned int array
+# =========================================================================
+def pack_words(words):
+    return '\n'.join(map(lambda w: w[0], words)), array('I', map(lambda w: w[1], words)).tobytes()
+
+
+# =========================================================================
+# unpack_words((string, bytes)) -> [(word, count), ...]
+# =========================================================================
+def unpack_words(payload):
+    text, count_bytes = payload
+    if not text:
+        return []
+    counts = array('I')
+    counts.frombytes(count_bytes)
+    return list(zip(text.split('\n'), counts))
+
+
+# =========================================================================
+# parse_packed(string) -> ((string, bytes), timings)
+# =========================================================================
+# - runs in the worker processes
+# =========================================================================
+def parse_packed(entry_content):
+    result = parser.parse_json(entry_content)
+    return pack_words(result['words']), result['timings']
+
+
+# =========================================================================
+# record_timings(timings)
+# =========================================================================
+def record_timings(timings):
+    for step, seconds in timings.items():
+        metrics.observe('parse_json.' + step, seconds)
+
+
+# =========================================================================
+# class ParserPool
+# =========================================================================
+# - if a process dies (OOM, kill) the pool is broken, then it is replaced by a new pool
+#   and the batch is parsed again (in the caller thread if the new pool breaks too)
+# =========================================================================
+class ParserPool:
+
+    # =========================================================================
+    # workers: number of processes (None: CPU-logical-cores, 0: parse in the caller thread)
+    # =========================================================================
+    def __init__(self, workers=None):
+        self.__workers = workers
+        self.__lock = Lock()
+        self.__executor = None
+        if workers != 0:
+            self.__executor = self.__create_executor()
+
+    # =========================================================================
+    def __create_executor(self):
+        # 'spawn': the pool is created at first use, when the fetch threads, the websocket loop and
+        # the snapshot connection are already running (a fork could inherit locked locks,
+        # the listening socket and the database handle, see also server_workers.py)
+        return concurrent.futures.ProcessPoolExecutor(self.__workers, mp_context=multiprocessing.get_context('spawn'))
+
+    # =========================================================================
+    # __replace_executor(broken executor)
+    # =========================================================================
+    # - the parallel callers see the same broken pool, only the first one replaces it
+    # =========================================================================
+    def __replace_executor(self, broken_executor):
+        with self.__lock:
+            if self.__executor is broken_executor:
+                broken_executor.shutdown(wait=False, cancel_futures=True)
+                self.__executor = self.__create_executor()
+            return self.__executor
+
+    # =========================================================================
+    # parse_many([string, ...]) -> [[(word, count), ...], ...]
+    # =========================================================================
+    def parse_many(self, contents):
+        executor = self.__executor
+        if executor is None:
+            return ParserPool.__parse_in_thread(contents)
+
+        try:
+            return ParserPool.__parse_in_pool(executor, contents)
+        except BrokenProcessPool as error:
+            print(f'ParserPool: the process pool is broken ({error}), the batch is parsed in a new pool')
+            metrics.count('parse_json.broken_pool')
+            executor = self.__replace_executor(executor)
+        try:
+            return ParserPool.__parse_in_pool(executor, contents)
+        except BrokenProcessPool as error:
+            print(f'ParserPool: the new process pool is broken too ({error}), the batch is parsed in the thread')
+            metrics.count('parse_json.broken_pool')
+            self.__replace_executor(executor)
+            return ParserPool.__parse_in_thread(contents)
+
+    # =========================================================================
+    @staticmethod
+    def __parse_in_thread(contents):
+        results = [parser.parse_json(content) for content in contents]
+        for result in results:
+            record_timings(result['timings'])
+        return [result['words'] for result in results]
+
+    # =========================================================================
+    @staticmethod
+    def __parse_in_pool(executor, contents):
+        # submit every content first, the processes can work parallel on them
+        futures = [executor.submit(parse_packed, content) for content in contents]
+        words_list = list()
+        for future in futures:
+            payload, timings = future.result()
+            record_timings(timings)
+            words_list.append(unpack_words(payload))
+        return words_list
+
+    # =========================================================================
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
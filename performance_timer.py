@@ -1,17 +1,24 @@
 import time
+from collections import deque
+from functools import wraps
+from threading import Lock
 
 
 # =========================================================================
 # PerformanceTimer
 # =========================================================================
+# - can be used as context manager: with PerformanceTimer('name') as pt: ...
+# - with a registry the measured durations are recorded (see MetricsRegistry)
+# =========================================================================
 class PerformanceTimer:
     name = ""
     start_t = -1
     end_t = -1
     duration_t = 0
 
-    def __init__(self, name):
+    def __init__(self, name, registry=None):
         self.name = name
+        self.registry = registry
 
     def start(self):
         self.start_t = time.perf_counter()
@@ -21,6 +28,8 @@ class PerformanceTimer:
             self.end_t = time.perf_counter()
             self.duration_t = self.end_t - self.start_t
             self.start_t = -1
+            if self.registry is not None:
+                self.registry.observe(self.name, self.duration_t)
 
     def duration(self, stop=False):
         if self.start_t != -1:
@@ -28,9 +37,124 @@ class PerformanceTimer:
             self.duration_t = self.end_t - self.start_t
             if stop:
                 self.start_t = -1
+                if self.registry is not None:
+                    self.registry.observe(self.name, self.duration_t)
 
         return self.duration_t
 
     def print_duration(self, stop=False):
         print(f"{self.name} duration: {self.duration(stop):.4f}s")
 
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+# =========================================================================
+# Histogram
+# =========================================================================
+# - count, sum and max of every value
+# - the percentiles are calculated from the last HISTORY values
+# =========================================================================
+class Histogram:
+    HISTORY = 2048
+
+    def __init__(self, history=HISTORY):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.values = deque(maxlen=history)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.values.append(value)
+
+    def summary(self, values):
+        # values: a copy of the stored values (the sort is done without lock)
+        result = {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                  'max': self.max}
+        if values:
+            values = sorted(values)
+            for name, quantile in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+                result[name] = values[int(quantile * (len(values) - 1))]
+        return result
+
+
+# =========================================================================
+# MetricsRegistry
+# =========================================================================
+# Thread-safe timers (histograms of seconds) and counters, for example:
+#   with metrics.timer('process_posts.parse'): ...
+#   @metrics.timed('append_posts')
+#   metrics.observe('parse_json.tokenize', seconds)
+#   metrics.count('get_posts.bytes', n)
+# - snapshot() returns the current values, dump() prints them
+# - the steps of a stage are named as '<stage>.<step>'
+# =========================================================================
+class MetricsRegistry:
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__histograms = dict()
+        self.__counters = dict()
+        self.__start = time.monotonic()
+
+    def observe(self, name, value):
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def count(self, name, value=1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def timer(self, name):
+        return PerformanceTimer(name, self)
+
+    def timed(self, name):
+        # decorator: every call is measured with a new timer (the calls can be parallel)
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with PerformanceTimer(name, self):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # =========================================================================
+    # snapshot() -> dict
+    # =========================================================================
+    # {'uptime': sec, 'timers': {name: {'count', 'total', 'mean', 'max', 'p50', 'p95', 'p99'}, ...},
+    #  'counters': {name: n, ...}}
+    # =========================================================================
+    def snapshot(self):
+        with self.__lock:
+            histograms = [(name, histogram, list(histogram.values)) for name, histogram in self.__histograms.items()]
+            counters = dict(self.__counters)
+        return {'uptime': time.monotonic() - self.__start,
+                'timers': {name: histogram.summary(values) for name, histogram, values in sorted(histograms)},
+                'counters': dict(sorted(counters.items()))}
+
+    def dump(self):
+        snapshot = self.snapshot()
+        print(f"metrics (uptime {snapshot['uptime']:.0f}s)")
+        for name, summary in snapshot['timers'].items():
+            print(f"  {name:24} n={summary['count']:<8} mean={summary['mean'] * 1000:9.3f}ms "
+                  f"p50={summary.get('p50', 0.0) * 1000:9.3f}ms p95={summary.get('p95', 0.0) * 1000:9.3f}ms "
+                  f"p99={summary.get('p99', 0.0) * 1000:9.3f}ms max={summary['max'] * 1000:9.3f}ms")
+        for name, value in snapshot['counters'].items():
+            print(f"  {name:24} {value}")
+
+
+# =========================================================================
+# Global Metrics Registry
+# =========================================================================
+metrics = MetricsRegistry()
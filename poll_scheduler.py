@@ -0,0 +1,72 @@
+import random
+from collections import deque
+
+
+# #########################################################################
+# Poll scheduler
+# #########################################################################
+# Selects the sleep time between the WordPress client loops
+# - catch-up (not every post received): CATCH_UP_INTERVAL
+# - after changes: min_interval, without changes the interval is doubled until max_interval
+# - every interval is jittered (+/- JITTER)
+# - the GET rate is capped (max_request_rate requests/sec over a loop and its sleep)
+# - the change-detection latencies are recorded (see record_latency and state)
+# =========================================================================
+class PollScheduler:
+    CATCH_UP_INTERVAL = 0.1  # sec
+    BACKOFF = 2.0
+    JITTER = 0.2
+    # Number of the stored change-detection latencies
+    LATENCY_HISTORY = 1000
+
+    # =========================================================================
+    def __init__(self, min_interval, max_interval, max_request_rate):
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__max_request_rate = max_request_rate
+        self.__interval = min_interval
+        self.__delay = 0.0
+        self.__latencies = deque(maxlen=PollScheduler.LATENCY_HISTORY)
+
+    # =========================================================================
+    # next_delay(bool, int, int, float) -> float
+    # =========================================================================
+    # - ready: every post is received
+    # - changes: count of the new/changed/deleted posts in the last loop
+    # - requests: count of the GETs in the last loop
+    # - duration: duration of the last loop (sec)
+    # =========================================================================
+    def next_delay(self, ready, changes, requests, duration):
+        if not ready:
+            interval = PollScheduler.CATCH_UP_INTERVAL
+        else:
+            if changes > 0:
+                self.__interval = self.__min_interval
+            else:
+                self.__interval = min(self.__interval * PollScheduler.BACKOFF, self.__max_interval)
+            interval = self.__interval * random.uniform(1.0 - PollScheduler.JITTER, 1.0 + PollScheduler.JITTER)
+
+        # GET rate cap
+        rate_limited_interval = requests / self.__max_request_rate - duration
+        self.__delay = max(interval, rate_limited_interval)
+        return self.__delay
+
+    # =========================================================================
+    # record_latency(float)
+    # =========================================================================
+    # - time between the modification of a post and its detection (sec)
+    # =========================================================================
+    def record_latency(self, latency):
+        self.__latencies.append(latency)
+
+    # =========================================================================
+    # state() -> dict
+    # =========================================================================
+    def state(self):
+        result = {'interval': self.__interval, 'delay': self.__delay, 'latency_count': len(self.__latencies)}
+        if self.__latencies:
+            latencies = sorted(self.__latencies)
+            result['latency_p50'] = latencies[int(0.50 * (len(latencies) - 1))]
+            result['latency_p95'] = latencies[int(0.95 * (len(latencies) - 1))]
+            result['latency_max'] = latencies[-1]
+        return result
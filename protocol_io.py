@@ -1,16 +1,76 @@
 import json
+import time
+from array import array
+from collections import OrderedDict
+from threading import Lock
 
+import wire_encoding
+from change_log import ChangeLog
+from performance_timer import metrics
 from shared_storage import SharedDict
 from websocket_io import WebsocketIO
+from word_index import WordIndex
 
 
 # #########################################################################
 # Protocol
 # #########################################################################
 
+# =========================================================================
+# class Vocabulary
+# =========================================================================
+# Interned words, every word is stored only once for all posts
+# - the posts store word-ids instead of the words (see ProtocolData)
+# - the ids are never released (the vocabulary of the blog grows only slowly)
+# =========================================================================
+class Vocabulary:
+
+    # =========================================================================
+    def __init__(self):
+        self.__lock = Lock()
+        self.__ids = dict()
+        self.__words = list()
+
+    # =========================================================================
+    # encode([word, ...]) -> array of word-ids
+    # =========================================================================
+    def encode(self, words):
+        ids = array('I')
+        with self.__lock:
+            for word in words:
+                word_id = self.__ids.get(word)
+                if word_id is None:
+                    word_id = len(self.__words)
+                    self.__ids[word] = word_id
+                    self.__words.append(word)
+                ids.append(word_id)
+        return ids
+
+    # =========================================================================
+    # decode(array of word-ids) -> [word, ...]
+    # =========================================================================
+    def decode(self, ids):
+        # the list is only appended, reading it needs no lock
+        words = self.__words
+        return [words[word_id] for word_id in ids]
+
+    # =========================================================================
+    def __len__(self):
+        return len(self.__words)
+
+
+# the vocabulary of every post
+vocabulary = Vocabulary()
+
+
 # =========================================================================
 # class ProtocolData
 # =========================================================================
+# The words are stored as arrays of word-ids and counts (see Vocabulary),
+# dict() and json() return them as [[word, count], ...] as before
+# - words_of: the arrays of this post are shared (unchanged content, without decode/encode),
+#   the arrays are never modified after the creation
+# =========================================================================
 class ProtocolData:
     POST_ID = 'id'
     TITLE = 'title'
@@ -22,37 +82,62 @@ class ProtocolData:
     STS_NEW = 'new'
     STS_MODIFIED = 'modified'
 
+    __slots__ = ('__post_id', '__title', '__date', '__modify_date', '__status', '__word_ids', '__counts',
+                 '__content_hash')
+
     # =========================================================================
-    def __init__(self, post_id, title, date, modify_date, words):
-        self.__datadict = {ProtocolData.POST_ID: post_id,
-                           ProtocolData.TITLE: title,
-                           ProtocolData.DATE: date,
-                           ProtocolData.MODIFY_DATE: modify_date,
-                           ProtocolData.STATUS: ProtocolData.STS_NEW,
-                           ProtocolData.WORDS: words
-                           }
+    def __init__(self, post_id, title, date, modify_date, words, content_hash=None, words_of=None):
+        # hash of the rendered content (it is not part of the protocol)
+        self.__content_hash = content_hash
+        self.__post_id = post_id
+        self.__title = title
+        self.__date = date
+        self.__modify_date = modify_date
+        self.__status = ProtocolData.STS_NEW
+        self.__word_ids = None
+        self.__counts = None
+        if words_of is not None:
+            self.__word_ids = words_of.__word_ids
+            self.__counts = words_of.__counts
+        elif words is not None:
+            self.__word_ids = vocabulary.encode(map(lambda w: w[0], words))
+            self.__counts = array('I', map(lambda w: w[1], words))
 
     # =========================================================================
-    def id(self): return self.__datadict[ProtocolData.POST_ID]
-    def title(self): return self.__datadict[ProtocolData.TITLE]
-    def date(self): return self.__datadict[ProtocolData.DATE]
-    def modify_date(self): return self.__datadict[ProtocolData.MODIFY_DATE]
-    def status(self): return self.__datadict[ProtocolData.STATUS]
-    def words(self): return self.__datadict[ProtocolData.WORDS]
-    def mark_new(self): self.__datadict[ProtocolData.STATUS] = ProtocolData.STS_NEW
-    def mark_modified(self): self.__datadict[ProtocolData.STATUS] = ProtocolData.STS_MODIFIED
+    def id(self): return self.__post_id
+    def title(self): return self.__title
+    def date(self): return self.__date
+    def modify_date(self): return self.__modify_date
+    def status(self): return self.__status
+    def content_hash(self): return self.__content_hash
+    def mark_new(self): self.__status = ProtocolData.STS_NEW
+    def mark_modified(self): self.__status = ProtocolData.STS_MODIFIED
+
+    # =========================================================================
+    # words() -> [(word, count), ...]
+    # =========================================================================
+    def words(self):
+        if self.__word_ids is None:
+            return None
+        return list(zip(vocabulary.decode(self.__word_ids), self.__counts))
 
     # =========================================================================
     def print(self):
-        print(self.__datadict)
+        print(self.dict())
 
     # =========================================================================
     def json(self):
-        return json.dumps(self.__datadict)
+        return wire_encoding.dumps(self.dict())
 
     # =========================================================================
     def dict(self):
-        return self.__datadict
+        return {ProtocolData.POST_ID: self.__post_id,
+                ProtocolData.TITLE: self.__title,
+                ProtocolData.DATE: self.__date,
+                ProtocolData.MODIFY_DATE: self.__modify_date,
+                ProtocolData.STATUS: self.__status,
+                ProtocolData.WORDS: self.words()
+                }
 
 
 # =========================================================================
@@ -63,49 +148,287 @@ class Protocol:
     __DELETED_POSTS = 'deleted_posts'
     __CHANGED_POSTS = 'changed_posts'
     __CLIENTS = 'clients'
+    __SEQ = 'seq'
+    __CHANGES = 'changes'
+    __SUBSCRIBE = 'subscribe'
+    __UNSUBSCRIBE = 'unsubscribe'
+    __WORDS = 'words'
+    __SINCE = 'since'
     __REQ = 'req'
+    __REQ_ID = 'req_id'
     __ACK = 'ack'
     __ID_LIST = 'id_list'
     __POST = 'post'
+    __POSTS = 'posts'
+    __IDS = 'ids'
+    __MORE = 'more'
+    __OFFSET = 'offset'
+    __LIMIT = 'limit'
+    __MODIFIED_SINCE = 'modified_since'
+    __TOTAL = 'total'
+    __NEXT = 'next'
+    __POST_DELTA = 'post_delta'
+    __TOP_WORDS = 'top_words'
+    __WORD = 'word'
+    __N = 'n'
+    __COUNT = 'count'
+    __BASE = 'base'
+    __STATS = 'stats'
+    __UNKNOWN = 'unknown'
+    __ERROR = 'error'
     __OBJ = 'obj'
 
+    # The request types of the request stats (every other request is counted as 'unknown')
+    __REQUESTS = (__ACK, __ID_LIST, __POST, __POSTS, __POST_DELTA, __TOP_WORDS, __WORD, __CHANGES,
+                  __SUBSCRIBE, __UNSUBSCRIBE, __STATS)
+
+    # Maximal number of the cached (serialized) 'post' answers
+    ANSWER_CACHE_SIZE = 4096
+
+    # Maximal number of the posts in one 'posts' answer (the rest is returned as 'more')
+    # TODO - can be set to the desired value
+    MAX_BATCH_POSTS = 100
+
+    # The changes within this window are merged into one notification
+    # TODO - can be set to the desired value (seconds)
+    NOTIFY_WINDOW = 0.5  # sec
+
     # =========================================================================
     def __init__(self):
         # Create websocketIO object with 'process_message' as the callback function
-        self.__websocket_object = WebsocketIO(self.process_message)
+        # (the not cached answers are created in a thread, see is_expensive)
+        # (the pending broadcasts of a slow client are merged, see merge_notifications)
+        self.__websocket_object = WebsocketIO(self.process_message, self.is_expensive, self.merge_notifications)
         # Create the dictionaries and set
-        self.__processed_posts = SharedDict()
+        # (the posts are read by every client, without lock and with consistent iterations)
+        self.__processed_posts = SharedDict(copy_on_write=True)
         self.__changed_posts = SharedDict({Protocol.__NEW_POSTS: [],
                                            Protocol.__DELETED_POSTS: [],
                                            Protocol.__CHANGED_POSTS: [],
                                            Protocol.__CLIENTS: 0
                                            })
         self.__tmp_active_set = set()
+        # merged changes (only used in the event loop), they are broadcast at the end of the window
+        self.__pending_changes = None
+        # the broadcast changes with sequence numbers (for the reconnecting clients)
+        self.__change_log = ChangeLog()
+        # words of the new/changed/deleted posts (only collected if a client subscribed to words)
+        # - post key -> {word, ...}, the pending words are merged in the event loop like the changes
+        self.__touched_lock = Lock()
+        self.__touched_words = dict()
+        self.__pending_words = None
+        self.__pending_seq = None
+        # the changes are published to the websocket worker processes (see server_workers.py)
+        self.__publisher = None
+        # word-count delta of the last change per post (see post_delta)
+        self.__post_deltas = SharedDict()
+        # global word counts and inverted index of the stored posts
+        self.__word_index = WordIndex()
+        # keys changed/deleted since the last snapshot (None: not tracked yet, see take_snapshot_changes)
+        self.__snapshot_lock = Lock()
+        self.__snapshot_keys = None
+        self.__snapshot_deleted_keys = None
+        # Serialized answers (shared by every client)
+        # - 'post' answers by post id (least recently used are dropped)
+        # - 'id_list' answer with a version (the answer is cached only if the list was not changed meanwhile)
+        self.__cache_lock = Lock()
+        self.__post_answers = OrderedDict()
+        self.__id_list_answer = None
+        self.__id_list_version = 0
+        self.__cache_stats = {'hits': 0, 'misses': 0, 'bytes_served': 0}
+        # answers per request type (see get_request_stats)
+        self.__request_stats = dict()
+
+    # =========================================================================
+    def infinite_io_loop(self, reuse_port=False):
+        self.__websocket_object.start_server(reuse_port)
+
+    # =========================================================================
+    # set_publisher(UpdatePublisher)
+    # =========================================================================
+    # - the stored posts and the notifications are published to the worker processes,
+    #   the clients are served by the workers
+    # =========================================================================
+    def set_publisher(self, publisher):
+        self.__publisher = publisher
 
     # =========================================================================
-    def infinite_io_loop(self):
-        self.__websocket_object.start_server()
+    def get_change_seq(self):
+        return self.__change_log.last_seq()
 
     # =========================================================================
-    def notify_clients(self):
+    def reset_change_seq(self, seq):
+        self.__change_log.reset(seq)
+
+    # =========================================================================
+    @metrics.timed('notify_clients')
+    def notify_clients(self, seq=None):
         # =========================================================================
         # SERVER
         # - broadcasts the current changes
-        #   {'new_posts': [], 'deleted_posts': [], 'changed_posts': [], 'clients:' n }
+        #   {'new_posts': [], 'deleted_posts': [], 'changed_posts': [], 'clients:' n, 'seq': 1634567890123 }
+        #   (see the 'changes' request for the sequence number)
         # CLIENT
         #   {'req': 'ack'}
         # =========================================================================
-        self.__changed_posts[Protocol.__CLIENTS] = self.__websocket_object.get_client_count()
-        message = self.__changed_posts.json()
-        self.__changed_posts.reset()
-        self.__websocket_object.broadcast(message)
+        # - can be called from any thread, the changes are handed over to the event loop
+        # - nothing is broadcast without changes
+        # - the changes of several calls are merged within NOTIFY_WINDOW
+        # - the subscribed clients get only the changes of their posts/words (see subscribe)
+        # - seq: the sequence number of the publisher (in a worker process)
+        changes = self.__changed_posts.reset()
+        with self.__touched_lock:
+            touched_words = self.__touched_words
+            self.__touched_words = dict()
+        if not (changes[Protocol.__NEW_POSTS] or changes[Protocol.__DELETED_POSTS]
+                or changes[Protocol.__CHANGED_POSTS]):
+            return
+        if self.__publisher is not None:
+            # the workers broadcast the changes with the same sequence number
+            self.__publisher.publish_notify(self.__change_log.append(changes))
+            return
+        self.__websocket_object.call_soon_threadsafe(self.__queue_changes, changes, touched_words, seq)
+
+    # =========================================================================
+    def __queue_changes(self, changes, touched_words, seq):
+        # in the event loop: merge the changes (a new window is started by the first changes)
+        if self.__pending_changes is None:
+            self.__pending_changes = Protocol.empty_changes()
+            self.__pending_words = dict()
+            self.__websocket_object.call_later(Protocol.NOTIFY_WINDOW, self.__flush_changes)
+        Protocol.merge_changes(self.__pending_changes, changes)
+        self.__pending_seq = seq
+        for key, words in touched_words.items():
+            self.__pending_words.setdefault(key, set()).update(words)
 
     # =========================================================================
-    def process_message(self, message):
+    @metrics.timed('notify_clients.flush')
+    def __flush_changes(self):
+        # in the event loop: broadcast the merged changes of the window
+        changes = self.__pending_changes
+        touched_words = self.__pending_words
+        self.__pending_changes = None
+        self.__pending_words = None
+        changes[Protocol.__SEQ] = self.__change_log.append(dict(changes), self.__pending_seq)
+        changes[Protocol.__CLIENTS] = self.__websocket_object.get_client_count()
+        # every change to the clients without subscription
+        self.__websocket_object.broadcast(wire_encoding.dumps(changes))
+
+        # the changes of the subscribed posts/words to the subscribed clients
+        keys = changes[Protocol.__NEW_POSTS] + changes[Protocol.__DELETED_POSTS] + changes[Protocol.__CHANGED_POSTS]
+        routed = self.__websocket_object.route(Protocol.__IDS, ((key, key) for key in keys))
+        routed = self.__websocket_object.route(Protocol.__WORDS, ((word, key) for key, words in touched_words.items()
+                                                                  for word in words), routed)
+        for client, client_keys in routed.items():
+            client_changes = dict(changes)
+            for name in (Protocol.__NEW_POSTS, Protocol.__DELETED_POSTS, Protocol.__CHANGED_POSTS):
+                client_changes[name] = [key for key in changes[name] if key in client_keys]
+            self.__websocket_object.send(client, wire_encoding.dumps(client_changes))
+        metrics.count('notify_clients.broadcasts')
+        metrics.count('notify_clients.routed', len(routed))
+
+    # =========================================================================
+    def __touch_words(self, key, words):
+        # collects the words of a changed post for the word subscriptions
+        with self.__touched_lock:
+            self.__touched_words.setdefault(key, set()).update(words)
+
+    # =========================================================================
+    # merge_changes(dict, dict)
+    # =========================================================================
+    # - merges the (newer) changes into the target, both are change notifications
+    #   {'new_posts': [], 'deleted_posts': [], 'changed_posts': [], 'clients:' n }
+    # - a new post is removed from the deleted/changed posts
+    # - a changed post is not listed if it is a new post
+    # - a deleted post is removed from the new/changed posts
+    #   (in one notification the deletions are the latest changes, see wordpress_io.client)
+    # - the sequence number of the newer changes is kept
+    # =========================================================================
+    @staticmethod
+    def merge_changes(target, changes):
+        new_posts = dict.fromkeys(target[Protocol.__NEW_POSTS])
+        deleted_posts = dict.fromkeys(target[Protocol.__DELETED_POSTS])
+        changed_posts = dict.fromkeys(target[Protocol.__CHANGED_POSTS])
+        for key in changes[Protocol.__NEW_POSTS]:
+            deleted_posts.pop(key, None)
+            changed_posts.pop(key, None)
+            new_posts[key] = None
+        for key in changes[Protocol.__CHANGED_POSTS]:
+            if key not in new_posts:
+                changed_posts[key] = None
+        for key in changes[Protocol.__DELETED_POSTS]:
+            new_posts.pop(key, None)
+            changed_posts.pop(key, None)
+            deleted_posts[key] = None
+        target[Protocol.__NEW_POSTS] = list(new_posts)
+        target[Protocol.__DELETED_POSTS] = list(deleted_posts)
+        target[Protocol.__CHANGED_POSTS] = list(changed_posts)
+        target[Protocol.__CLIENTS] = changes.get(Protocol.__CLIENTS, target.get(Protocol.__CLIENTS, 0))
+        if Protocol.__SEQ in changes:
+            target[Protocol.__SEQ] = changes[Protocol.__SEQ]
+
+    # =========================================================================
+    @staticmethod
+    def empty_changes():
+        return {Protocol.__NEW_POSTS: [], Protocol.__DELETED_POSTS: [], Protocol.__CHANGED_POSTS: [],
+                Protocol.__CLIENTS: 0}
+
+    # =========================================================================
+    def merge_notifications(self, messages):
+        # the serialized change notifications are merged into one
+        merged = Protocol.empty_changes()
+        for message in messages:
+            Protocol.merge_changes(merged, wire_encoding.loads(message))
+        return wire_encoding.dumps(merged)
+
+    # =========================================================================
+    def get_queue_stats(self):
+        return self.__websocket_object.get_queue_stats()
+
+    # =========================================================================
+    def is_expensive(self, message):
+        # the cached answers are cheap, everything else is processed in a thread
+        try:
+            json_msg = wire_encoding.loads(message)
+            req = json_msg[Protocol.__REQ]
+            # (the subscriptions are changed only in the event loop)
+            # (the queue and encoding stats are read only in the event loop)
+            # (the word ranking is rebuilt after the changes, then top_words is processed in a thread)
+            if req == Protocol.__TOP_WORDS:
+                return not self.__word_index.has_top()
+            if req in (Protocol.__ACK, Protocol.__POST_DELTA, Protocol.__WORD,
+                       Protocol.__CHANGES, Protocol.__SUBSCRIBE, Protocol.__UNSUBSCRIBE, Protocol.__STATS):
+                return False
+            with self.__cache_lock:
+                if req == Protocol.__ID_LIST:
+                    return self.__id_list_answer is None or not Protocol.__is_full_id_list(json_msg)
+                if req == Protocol.__POST:
+                    return json_msg[ProtocolData.POST_ID] not in self.__post_answers
+        except (json.JSONDecodeError, KeyError, TypeError):
+            # the error is reported by process_message
+            return False
+        return True
+
+    # =========================================================================
+    def process_message(self, message, client=None):
+        # =========================================================================
+        # Every request can contain a request id, which is returned in the answer
+        # CLIENT --> {'req': ***, 'req_id': 42, ...}
+        #
+        # SERVER --> {'req_id': 42, 'ack': ***, ...}
+        # =========================================================================
+        # A request with missing or invalid parameters is answered with an error
+        # SERVER --> {'req_id': 42, 'ack': ***, 'obj': null, 'error': 'invalid parameter: ...'}
+        # =========================================================================
         answer = None
+        json_msg = None
+        start = time.perf_counter()
         try:
-            json_msg = json.loads(message)
+            json_msg = wire_encoding.loads(message)
             req = json_msg[Protocol.__REQ]
+            if not isinstance(req, str):
+                print(f'Protocol error \'{message}\': invalid request')
+                return None
 
             # =========================================================================
             # ack
@@ -124,11 +447,21 @@ class Protocol:
             # SERVER --> {'ack': 'id_list', 'obj': [12345, 4321, ...]}
             # (Returns the available id-s)
             # =========================================================================
+            # CLIENT --> {'req': 'id_list', 'offset': 0, 'limit': 500, 'modified_since': '2021-10-01T12:00:00'}
+            # (every parameter is optional, the id-s are sorted if any of them is given,
+            #  offset is at least 0, limit is at least 1)
+            #
+            # SERVER --> {'ack': 'id_list', 'obj': [4321, 12345, ...], 'total': 1234, 'next': 500}
+            # (Returns a page of the id-s modified at or after 'modified_since',
+            #  'total' is the count of the matching id-s, 'next' is the offset of the next page or null)
+            # =========================================================================
             elif req == Protocol.__ID_LIST:
-                # get the keys as a list
-                obj = list(self.__processed_posts.keys())
-                # create a string
-                answer = json.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+                if Protocol.__is_full_id_list(json_msg):
+                    answer = self.__get_id_list_answer()
+                else:
+                    answer = self.__get_id_list_page(json_msg.get(Protocol.__OFFSET, 0),
+                                                     json_msg.get(Protocol.__LIMIT),
+                                                     json_msg.get(Protocol.__MODIFIED_SINCE))
 
             # =========================================================================
             # posts - Get words of selected post
@@ -139,35 +472,468 @@ class Protocol:
             # (Returns the requested post or 'None'/null if the post not exists)
             # =========================================================================
             elif req == Protocol.__POST:
-                # get the ProtocolData Object as dictionary
-                obj = self.__processed_posts.get(json_msg[ProtocolData.POST_ID])
-                # if it is a valid ProtocolData object, convert it to dictionary
-                # otherwise use it as None value
-                if obj is not None:
-                    obj = obj.dict()
-                # create a string
-                answer = json.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+                answer = self.__get_post_answer(json_msg[ProtocolData.POST_ID])
+
+            # =========================================================================
+            # posts - Get words of several posts
+            # =========================================================================
+            # CLIENT --> {'req': 'posts', 'ids': [14333, 17444, ...]}
+            #
+            # SERVER --> {'ack': 'posts', 'obj': [{'id': 14333, ...}, null, ...], 'more': [...]}
+            # (Returns the requested posts in the requested order, 'None'/null if a post not exists,
+            #  at most MAX_BATCH_POSTS posts are returned, the not answered id-s are listed in 'more')
+            # =========================================================================
+            elif req == Protocol.__POSTS:
+                answer = self.__get_posts_answer(Protocol.__list_parameter(json_msg[Protocol.__IDS], Protocol.__IDS))
+
+            # =========================================================================
+            # post_delta - Get the word-count changes of the last modification of a post
+            # =========================================================================
+            # CLIENT --> {'req': 'post_delta', 'id': 14333, 'base': '2021-10-01T12:00:00'}
+            # ('base' is the modify_date of the locally stored post)
+            #
+            # SERVER --> {'ack': 'post_delta', 'obj': {'id': 14333, 'title': 'This is a title',
+            #                                          'base': '2021-10-01T12:00:00',
+            #                                          'modify_date': '2021-10-02T08:00:00',
+            #                                          'added': [['word', 2], ...], 'removed': ['word', ...],
+            #                                          'changed': [['word', 5], ...]}}
+            # (Returns 'None'/null if there is no delta from the given base, then the 'post' should be requested)
+            # =========================================================================
+            elif req == Protocol.__POST_DELTA:
+                obj = self.__post_deltas.get(str(json_msg[ProtocolData.POST_ID]))
+                if obj is not None and obj[Protocol.__BASE] != json_msg[Protocol.__BASE]:
+                    obj = None
+                answer = wire_encoding.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+
+            # =========================================================================
+            # top_words - Get the most frequent words of every post
+            # =========================================================================
+            # CLIENT --> {'req': 'top_words', 'n': 100}
+            #
+            # SERVER --> {'ack': 'top_words', 'obj': [['word', 1234], ...]}
+            # (Returns at most WordIndex.MAX_TOP_WORDS words)
+            # =========================================================================
+            elif req == Protocol.__TOP_WORDS:
+                obj = self.__word_index.top(int(json_msg[Protocol.__N]))
+                answer = wire_encoding.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+
+            # =========================================================================
+            # word - Get the posts of a word
+            # =========================================================================
+            # CLIENT --> {'req': 'word', 'word': 'server'}
+            #
+            # SERVER --> {'ack': 'word', 'obj': {'word': 'server', 'count': 42,
+            #                                    'posts': [['14333', 40], ['17444', 2]]}}
+            # (Returns the total count and the [post id, count] pairs or 'None'/null if no post contains the word,
+            #  the post id-s are strings as in the 'id_list' answer and in the change notifications)
+            # =========================================================================
+            elif req == Protocol.__WORD:
+                word = json_msg[Protocol.__WORD]
+                if not isinstance(word, str):
+                    raise TypeError(f'{Protocol.__WORD} should be a string')
+                word = word.lower()
+                obj = None
+                found = self.__word_index.lookup(word)
+                if found is not None:
+                    obj = {Protocol.__WORD: word, Protocol.__COUNT: found[0], Protocol.__POSTS: found[1]}
+                answer = wire_encoding.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+
+            # =========================================================================
+            # changes - Get the missed changes (e.g. after a reconnect)
+            # =========================================================================
+            # CLIENT --> {'req': 'changes', 'since': 1634567890123}
+            # ('since' is the 'seq' of the last received change notification)
+            #
+            # SERVER --> {'ack': 'changes', 'seq': 1634567890125,
+            #             'obj': {'new_posts': [], 'deleted_posts': [], 'changed_posts': [], 'clients': 0}}
+            # (Returns the merged changes after 'since' and the current sequence number, or 'None'/null
+            #  if the changes are not stored any more, then the id_list and the posts should be requested)
+            # =========================================================================
+            elif req == Protocol.__CHANGES:
+                seq, entries = self.__change_log.since(int(json_msg[Protocol.__SINCE]))
+                obj = None
+                if entries is not None:
+                    obj = Protocol.empty_changes()
+                    for changes in entries:
+                        Protocol.merge_changes(obj, changes)
+                    obj[Protocol.__CLIENTS] = self.__websocket_object.get_client_count()
+                answer = wire_encoding.dumps({Protocol.__ACK: req, Protocol.__SEQ: seq, Protocol.__OBJ: obj})
+
+            # =========================================================================
+            # subscribe - Receive only the changes of the selected posts and words
+            # =========================================================================
+            # CLIENT --> {'req': 'subscribe', 'ids': [14333, ...], 'words': ['server', ...]}
+            # (both lists are optional, the subscriptions are added to the earlier ones)
+            #
+            # SERVER --> {'ack': 'subscribe', 'obj': {'ids': ['14333', ...], 'words': ['server', ...]}}
+            # (Returns the subscribed id-s and words, from now on the change notifications contain
+            #  only the new/changed/deleted posts with the id-s or (old or new) words,
+            #  the 'changes' request returns every change)
+            # =========================================================================
+            # unsubscribe - Remove subscriptions
+            # =========================================================================
+            # CLIENT --> {'req': 'unsubscribe', 'ids': [14333, ...], 'words': ['server', ...]}
+            # (without 'ids' and 'words' every subscription is removed, then every change is received)
+            #
+            # SERVER --> {'ack': 'unsubscribe', 'obj': {'ids': ['14333', ...], 'words': ['server', ...]}}
+            # =========================================================================
+            elif req == Protocol.__SUBSCRIBE or req == Protocol.__UNSUBSCRIBE:
+                post_keys = [str(post_id) for post_id in
+                             Protocol.__list_parameter(json_msg.get(Protocol.__IDS, []), Protocol.__IDS)]
+                words = [word.lower() for word in
+                         Protocol.__list_parameter(json_msg.get(Protocol.__WORDS, []), Protocol.__WORDS, str)]
+                if client is not None:
+                    if req == Protocol.__SUBSCRIBE:
+                        self.__websocket_object.subscribe(client, Protocol.__IDS, post_keys)
+                        self.__websocket_object.subscribe(client, Protocol.__WORDS, words)
+                    elif Protocol.__IDS not in json_msg and Protocol.__WORDS not in json_msg:
+                        self.__websocket_object.unsubscribe(client)
+                    else:
+                        self.__websocket_object.unsubscribe(client, Protocol.__IDS, post_keys)
+                        self.__websocket_object.unsubscribe(client, Protocol.__WORDS, words)
+                obj = {Protocol.__IDS: post_keys, Protocol.__WORDS: words}
+                answer = wire_encoding.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+
+            # =========================================================================
+            # stats - Get the server metrics
+            # =========================================================================
+            # CLIENT --> {'req': 'stats'}
+            #
+            # SERVER --> {'ack': 'stats', 'obj': {'metrics': {'uptime': sec, 'timers': {...}, 'counters': {...}},
+            #             'cache': {...}, 'requests': {...}, 'queues': {...}, 'encoding': {...},
+            #             'subscriptions': {...}, 'word_index': {...}}}
+            # (the timers are in seconds: {'count', 'total', 'mean', 'max', 'p50', 'p95', 'p99'},
+            #  see performance_timer.py; in the multi-process mode every worker returns its own metrics)
+            # =========================================================================
+            elif req == Protocol.__STATS:
+                obj = {'metrics': metrics.snapshot(),
+                       'cache': self.get_cache_stats(),
+                       'requests': self.get_request_stats(),
+                       'queues': self.get_queue_stats(),
+                       'encoding': self.get_encoding_stats(),
+                       'subscriptions': self.get_subscription_stats(),
+                       'word_index': self.get_word_index_stats()}
+                answer = wire_encoding.dumps({Protocol.__ACK: req, Protocol.__OBJ: obj})
+
+            # insert the request id into the (serialized) answer
+            if answer is not None and Protocol.__REQ_ID in json_msg:
+                answer = f'{{"{Protocol.__REQ_ID}":{wire_encoding.dumps(json_msg[Protocol.__REQ_ID])},{answer[1:]}'
+            self.__count_request(req, answer, time.perf_counter() - start)
             return answer
 
         except json.JSONDecodeError as error:
             print(f'Protocol error \'{message}\': {error}')
-        except KeyError as error:
+        except (KeyError, TypeError, ValueError, AttributeError) as error:
             print(f'Protocol error \'{message}\': {error}')
+            return self.__get_error_answer(json_msg, error, time.perf_counter() - start)
+
+    # =========================================================================
+    # __get_error_answer(dict, error, duration) -> string or None
+    # =========================================================================
+    # - the (pipelined) client gets an answer with its request id
+    # - None if the request type is not known
+    # =========================================================================
+    def __get_error_answer(self, json_msg, error, duration):
+        if not isinstance(json_msg, dict) or json_msg.get(Protocol.__REQ) not in Protocol.__REQUESTS:
+            return None
+        req = json_msg[Protocol.__REQ]
+        obj = {Protocol.__ACK: req, Protocol.__OBJ: None, Protocol.__ERROR: f'invalid parameter: {error}'}
+        if Protocol.__REQ_ID in json_msg:
+            obj = dict({Protocol.__REQ_ID: json_msg[Protocol.__REQ_ID]}, **obj)
+        answer = wire_encoding.dumps(obj)
+        self.__count_request(req, answer, duration)
+        return answer
+
+    # =========================================================================
+    # __list_parameter(list, name, type) -> list
+    # =========================================================================
+    # - raises TypeError if the parameter is not a list (of the given type)
+    # =========================================================================
+    @staticmethod
+    def __list_parameter(values, name, item_type=None):
+        if not isinstance(values, list) or \
+                (item_type is not None and not all(isinstance(value, item_type) for value in values)):
+            raise TypeError(f'{name} should be a list')
+        return values
+
+    # =========================================================================
+    def __count_request(self, req, answer, duration):
+        # the request types are limited, the clients cannot add new keys
+        key = req if req in Protocol.__REQUESTS else Protocol.__UNKNOWN
+        with self.__cache_lock:
+            stats = self.__request_stats.setdefault(key, {'requests': 0, 'bytes': 0, 'time': 0.0})
+            stats['requests'] += 1
+            stats['bytes'] += len(answer) if answer is not None else 0
+            stats['time'] += duration
+        metrics.observe('process_message.' + key, duration)
+
+    # =========================================================================
+    # get_request_stats() -> dict
+    # =========================================================================
+    # {'post': {'requests': n, 'bytes': n, 'time': sec}, ..., 'unknown': {...}}
+    # - bytes: the serialized answers (JSON text, before the wire encoding)
+    # - time: creating the answers (serialization or cache lookup)
+    # =========================================================================
+    def get_request_stats(self):
+        with self.__cache_lock:
+            return {req: dict(stats) for req, stats in self.__request_stats.items()}
+
+    # =========================================================================
+    def get_encoding_stats(self):
+        return self.__websocket_object.get_encoding_stats()
+
+    # =========================================================================
+    def get_subscription_stats(self):
+        return self.__websocket_object.get_subscription_stats()
+
+    # =========================================================================
+    def __count_answer(self, hit, answer):
+        with self.__cache_lock:
+            self.__cache_stats['hits' if hit else 'misses'] += 1
+            self.__cache_stats['bytes_served'] += len(answer)
+
+    # =========================================================================
+    def __get_id_list_answer(self):
+        with self.__cache_lock:
+            answer = self.__id_list_answer
+            version = self.__id_list_version
+        if answer is not None:
+            self.__count_answer(True, answer)
+            return answer
+
+        # get the keys as a list
+        obj = self.__processed_posts.keys()
+        # create a string
+        answer = wire_encoding.dumps({Protocol.__ACK: Protocol.__ID_LIST, Protocol.__OBJ: obj})
+        with self.__cache_lock:
+            if version == self.__id_list_version:
+                self.__id_list_answer = answer
+        self.__count_answer(False, answer)
+        return answer
+
+    # =========================================================================
+    @staticmethod
+    def __is_full_id_list(json_msg):
+        return (Protocol.__OFFSET not in json_msg and Protocol.__LIMIT not in json_msg
+                and Protocol.__MODIFIED_SINCE not in json_msg)
+
+    # =========================================================================
+    def __get_id_list_page(self, offset, limit, modified_since):
+        # the pages are not cached (the answer depends on the parameters)
+        # - offset >= 0 and limit >= 1 (with limit 0 'next' would be the same offset)
+        offset = max(int(offset), 0)
+        if limit is not None:
+            limit = max(int(limit), 1)
+        if modified_since is not None and not isinstance(modified_since, str):
+            raise TypeError(f'{Protocol.__MODIFIED_SINCE} should be a string')
+        posts = self.__processed_posts.items()
+        if modified_since is not None:
+            posts = filter(lambda item: item[1].modify_date() >= modified_since, posts)
+        obj = sorted(map(lambda item: item[0], posts), key=int)
+        total = len(obj)
+        end = total if limit is None else offset + limit
+        obj = obj[offset:end]
+        answer = wire_encoding.dumps({Protocol.__ACK: Protocol.__ID_LIST, Protocol.__OBJ: obj, Protocol.__TOTAL: total,
+                                      Protocol.__NEXT: end if end < total else None})
+        self.__count_answer(False, answer)
+        return answer
+
+    # =========================================================================
+    def __get_posts_answer(self, post_ids):
+        # the serialized objects are cut from the (cached) 'post' answers
+        prefix_length = len(wire_encoding.dumps({Protocol.__ACK: Protocol.__POST, Protocol.__OBJ: None})) - len('null}')
+        objs = list()
+        for post_id in post_ids[:Protocol.MAX_BATCH_POSTS]:
+            objs.append(self.__get_post_answer(str(post_id))[prefix_length:-1])
+        more = wire_encoding.dumps(post_ids[Protocol.MAX_BATCH_POSTS:])
+        # (compact, with the separators of wire_encoding.dumps)
+        return f'{{"{Protocol.__ACK}":"{Protocol.__POSTS}","{Protocol.__OBJ}":[{",".join(objs)}],' \
+               f'"{Protocol.__MORE}":{more}}}'
+
+    # =========================================================================
+    def __get_post_answer(self, key):
+        if isinstance(key, str):
+            with self.__cache_lock:
+                answer = self.__post_answers.get(key)
+                if answer is not None:
+                    self.__post_answers.move_to_end(key)
+            if answer is not None:
+                self.__count_answer(True, answer)
+                return answer
+
+        # get the ProtocolData Object as dictionary
+        post = self.__processed_posts.get(key)
+        # if it is a valid ProtocolData object, convert it to dictionary
+        # otherwise use it as None value
+        obj = None
+        if post is not None:
+            obj = post.dict()
+        # create a string
+        answer = wire_encoding.dumps({Protocol.__ACK: Protocol.__POST, Protocol.__OBJ: obj})
+        if post is not None:
+            with self.__cache_lock:
+                # only the answer of the stored post is cached (not of a replaced one)
+                if self.__processed_posts.get(key) is post:
+                    self.__post_answers[key] = answer
+                    if len(self.__post_answers) > Protocol.ANSWER_CACHE_SIZE:
+                        self.__post_answers.popitem(last=False)
+        self.__count_answer(False, answer)
+        return answer
+
+    # =========================================================================
+    def __invalidate_answers(self, keys, id_list):
+        with self.__cache_lock:
+            for key in keys:
+                self.__post_answers.pop(key, None)
+            if id_list:
+                self.__id_list_answer = None
+                self.__id_list_version += 1
+
+    # =========================================================================
+    def get_cache_stats(self):
+        with self.__cache_lock:
+            stats = dict(self.__cache_stats, entries=len(self.__post_answers))
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / requests if requests else 0.0
+        return stats
+
+    # =========================================================================
+    # word_delta([(word, count), ...], [(word, count), ...]) -> dict
+    # =========================================================================
+    # {'added': [(word, count), ...], 'removed': [word, ...], 'changed': [(word, new_count), ...]}
+    # =========================================================================
+    @staticmethod
+    def word_delta(old_words, new_words):
+        old_counts = dict(old_words)
+        added = list()
+        changed = list()
+        for word, count in new_words:
+            old_count = old_counts.pop(word, None)
+            if old_count is None:
+                added.append((word, count))
+            elif old_count != count:
+                changed.append((word, count))
+        # the remaining words are removed
+        return {'added': added, 'removed': sorted(old_counts), 'changed': changed}
 
     # =========================================================================
+    @metrics.timed('append_posts')
     def append_posts(self, post):
         key = str(post.id())
+        stored_post = self.__processed_posts.get(key)
         # New post?
-        if self.__processed_posts.get(key) is None:
+        changed = True
+        if stored_post is None:
             # the default post status is new thus we simply store it
             self.__changed_posts[Protocol.__NEW_POSTS].append(key)
+            with metrics.timer('append_posts.word_index'):
+                self.__word_index.set_post(key, post.words() or [])
+            if self.__websocket_object.has_subscribers(Protocol.__WORDS):
+                self.__touch_words(key, map(lambda w: w[0], post.words() or []))
+        # Only unrelated fields are modified (same content and title)?
+        elif post.content_hash() is not None and post.content_hash() == stored_post.content_hash() \
+                and post.title() == stored_post.title():
+            # keep the status of the stored post and store it without broadcast
+            if stored_post.status() == ProtocolData.STS_MODIFIED:
+                post.mark_modified()
+            changed = False
         # Modified post?
         else:
             # mark the post as modified
             post.mark_modified()
+            # store the word-count delta from the stored post (see post_delta)
+            with metrics.timer('append_posts.delta'):
+                delta = Protocol.word_delta(stored_post.words() or [], post.words() or [])
+            delta.update({ProtocolData.POST_ID: post.id(),
+                          ProtocolData.TITLE: post.title(),
+                          Protocol.__BASE: stored_post.modify_date(),
+                          ProtocolData.MODIFY_DATE: post.modify_date()})
+            self.__post_deltas[key] = delta
+            with metrics.timer('append_posts.word_index'):
+                self.__word_index.set_post(key, post.words() or [])
+            if self.__websocket_object.has_subscribers(Protocol.__WORDS):
+                self.__touch_words(key, delta['removed'])
+                self.__touch_words(key, map(lambda w: w[0], delta['added'] + delta['changed']))
             #store it
             self.__changed_posts[Protocol.__CHANGED_POSTS].append(key)
         self.__processed_posts[key] = post
+        self.__invalidate_answers([key], stored_post is None)
+        with self.__snapshot_lock:
+            if self.__snapshot_keys is not None:
+                self.__snapshot_keys.add(key)
+                self.__snapshot_deleted_keys.discard(key)
+        if self.__publisher is not None:
+            with metrics.timer('append_posts.publish'):
+                self.__publisher.publish_posts([post])
+        # True if the clients will be notified
+        return changed
+
+    # =========================================================================
+    # restore_posts([ProtocolData, ...])
+    # =========================================================================
+    # - stores the posts of a snapshot without informing the clients
+    # - the changes are tracked from now on (see take_snapshot_changes)
+    # =========================================================================
+    def restore_posts(self, posts):
+        # one copy for every post (copy_on_write)
+        self.__processed_posts.update({str(post.id()): post for post in posts})
+        for post in posts:
+            self.__word_index.set_post(str(post.id()), post.words() or [])
+        self.__invalidate_answers([str(post.id()) for post in posts], True)
+        with self.__snapshot_lock:
+            self.__snapshot_keys = set()
+            self.__snapshot_deleted_keys = set()
+        if self.__publisher is not None:
+            self.__publisher.publish_restore(posts)
+
+    # =========================================================================
+    # take_snapshot_changes() -> ([ProtocolData, ...], [key, ...])
+    # =========================================================================
+    # - returns the posts changed and the keys deleted since the last call
+    #   (every stored post by the first call if nothing was restored)
+    # =========================================================================
+    def take_snapshot_changes(self):
+        with self.__snapshot_lock:
+            keys = self.__snapshot_keys
+            deleted_keys = self.__snapshot_deleted_keys
+            self.__snapshot_keys = set()
+            self.__snapshot_deleted_keys = set()
+        if keys is None:
+            keys = self.get_post_ids()
+            deleted_keys = set()
+        posts = [post for post in map(self.__processed_posts.get, keys) if post is not None]
+        return posts, list(deleted_keys)
+
+    # =========================================================================
+    # return_snapshot_changes([ProtocolData, ...], [key, ...])
+    # =========================================================================
+    # - the changes of a failed save are tracked again (see take_snapshot_changes)
+    # - the changes since the take are kept (a later change/deletion of the same key wins)
+    # =========================================================================
+    def return_snapshot_changes(self, posts, deleted_keys):
+        with self.__snapshot_lock:
+            for key in map(lambda post: str(post.id()), posts):
+                if key not in self.__snapshot_deleted_keys:
+                    self.__snapshot_keys.add(key)
+            for key in deleted_keys:
+                if key not in self.__snapshot_keys:
+                    self.__snapshot_deleted_keys.add(key)
+
+    # =========================================================================
+    def get_word_index_stats(self):
+        return self.__word_index.stats()
+
+    # =========================================================================
+    def get_post(self, post_id):
+        return self.__processed_posts.get(str(post_id))
+
+    # =========================================================================
+    def get_posts(self):
+        return self.__processed_posts.values()
+
+    # =========================================================================
+    def get_post_ids(self):
+        return self.__processed_posts.keys()
 
     # =========================================================================
     def mark_post_as_active(self, post_id):
@@ -175,9 +941,26 @@ class Protocol:
         self.__tmp_active_set.add(key)
 
     # =========================================================================
+    @metrics.timed('purge_inactive_posts')
     def purge_inactive_posts(self):
-        self.__changed_posts[Protocol.__DELETED_POSTS] = self.__processed_posts.purge(self.__tmp_active_set)
+        # the stored posts before the purge (for the words of the deleted posts)
+        stored_posts = self.__processed_posts.snapshot()
+        purged_posts = self.__processed_posts.purge(self.__tmp_active_set)
+        if self.__websocket_object.has_subscribers(Protocol.__WORDS):
+            for key in purged_posts:
+                self.__touch_words(key, map(lambda w: w[0], stored_posts[key].words() or []))
+        self.__post_deltas.purge(self.__tmp_active_set)
+        self.__word_index.remove_posts(purged_posts)
+        with self.__snapshot_lock:
+            if self.__snapshot_keys is not None:
+                self.__snapshot_keys.difference_update(purged_posts)
+                self.__snapshot_deleted_keys.update(purged_posts)
+        self.__invalidate_answers(purged_posts, True)
+        self.__changed_posts[Protocol.__DELETED_POSTS] = purged_posts
         self.__tmp_active_set.clear()
+        if self.__publisher is not None and purged_posts:
+            self.__publisher.publish_purge(purged_posts)
+        return purged_posts
 
     # =========================================================================
     def get_post_count(self):
@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import Listener, Client
+from threading import Lock
+
+import protocol_io as p_io
+from parser_pool import pack_words, unpack_words
+
+
+# #########################################################################
+# Websocket server workers
+# #########################################################################
+# Multi-process mode of the websocket server
+# - N worker processes serve the clients on the same port (SO_REUSEPORT)
+# - every worker has its own copy of the posts (its own Protocol object)
+# - the crawler process publishes the changes of its Protocol object over a unix socket:
+#   ('hello', seq)                 : sequence number of the last change notification
+#   ('restore', [packed post, ...]): every stored post (after connect or a snapshot load)
+#   ('posts', [packed post, ...])  : new/changed posts (see Protocol.append_posts)
+#   ('purge', [key, ...])          : deleted posts
+#   ('notify', seq)                : the changes should be broadcast with this sequence number
+# =========================================================================
+
+# Unix socket of the publisher
+# TODO - can be set to the desired path
+IPC_PATH = '/tmp/wordcount_server.sock'
+
+
+# =========================================================================
+# pack_post(ProtocolData) -> tuple
+# =========================================================================
+# - the word-ids are process local, therefore the words are sent (see parser_pool.pack_words)
+# =========================================================================
+def pack_post(post):
+    return (post.id(), post.title(), post.date(), post.modify_date(), post.status(), post.content_hash(),
+            pack_words(post.words()) if post.words() is not None else None)
+
+
+# =========================================================================
+# unpack_post(tuple) -> ProtocolData
+# =========================================================================
+def unpack_post(packed_post):
+    post_id, title, date, modify_date, status, content_hash, words = packed_post
+    post = p_io.ProtocolData(post_id, title, date, modify_date,
+                             unpack_words(words) if words is not None else None, content_hash)
+    if status == p_io.ProtocolData.STS_MODIFIED:
+        post.mark_modified()
+    return post
+
+
+# =========================================================================
+# class UpdatePublisher
+# =========================================================================
+# Sends the changes of the Protocol object to the connected workers
+# (set by Protocol.set_publisher, the publish methods are called by the Protocol)
+# =========================================================================
+class UpdatePublisher:
+
+    # =========================================================================
+    def __init__(self, path=IPC_PATH):
+        self.__path = path
+        self.__authkey = os.urandom(16)
+        if os.path.exists(path):
+            os.remove(path)
+        self.__listener = Listener(path, family='AF_UNIX', authkey=self.__authkey)
+        # the messages are sent in the same order to every worker
+        self.__lock = Lock()
+        self.__connections = list()
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    # =========================================================================
+    def path(self): return self.__path
+    def authkey(self): return self.__authkey
+
+    # =========================================================================
+    def __accept(self):
+        while True:
+            try:
+                connection = self.__listener.accept()
+            except (OSError, multiprocessing.AuthenticationError) as error:
+                print('UpdatePublisher: accept error: ', error)
+                continue
+            # the new worker gets every stored post first
+            # (a post changed meanwhile can be received twice, the second one is an unchanged update)
+            with self.__lock:
+                try:
+                    connection.send(('hello', p_io.protocol_object.get_change_seq()))
+                    connection.send(('restore', [pack_post(post) for post in p_io.protocol_object.get_posts()]))
+                    self.__connections.append(connection)
+                except OSError as error:
+                    print('UpdatePublisher: send error: ', error)
+
+    # =========================================================================
+    def __publish(self, message):
+        with self.__lock:
+            for connection in list(self.__connections):
+                try:
+                    connection.send(message)
+                except OSError as error:
+                    print('UpdatePublisher: worker is disconnected: ', error)
+                    self.__connections.remove(connection)
+
+    # =========================================================================
+    def publish_posts(self, posts):
+        self.__publish(('posts', [pack_post(post) for post in posts]))
+
+    def publish_restore(self, posts):
+        self.__publish(('restore', [pack_post(post) for post in posts]))
+
+    def publish_purge(self, keys):
+        self.__publish(('purge', list(keys)))
+
+    def publish_notify(self, seq):
+        self.__publish(('notify', seq))
+
+    # =========================================================================
+    def stats(self):
+        with self.__lock:
+            return {'workers': len(self.__connections)}
+
+
+# =========================================================================
+# apply_updates(connection)
+# =========================================================================
+# - runs in a thread of the worker, applies the published changes to its Protocol object
+# =========================================================================
+def apply_updates(connection):
+    protocol = p_io.protocol_object
+    while True:
+        try:
+            operation, argument = connection.recv()
+        except EOFError:
+            print('Worker: the publisher is closed')
+            os._exit(1)
+
+        if operation == 'hello':
+            protocol.reset_change_seq(argument)
+        elif operation == 'restore':
+            protocol.restore_posts([unpack_post(packed_post) for packed_post in argument])
+        elif operation == 'posts':
+            for packed_post in argument:
+                protocol.append_posts(unpack_post(packed_post))
+        elif operation == 'purge':
+            purged_keys = set(argument)
+            for key in protocol.get_post_ids():
+                if key not in purged_keys:
+                    protocol.mark_post_as_active(key)
+            protocol.purge_inactive_posts()
+        elif operation == 'notify':
+            protocol.notify_clients(argument)
+
+
+# =========================================================================
+# worker_main(index, path, authkey)
+# =========================================================================
+def worker_main(index, path, authkey):
+    print(f'Worker {index}: started (pid {os.getpid()})')
+    connection = Client(path, family='AF_UNIX', authkey=authkey)
+    threading.Thread(target=apply_updates, args=(connection,), daemon=True).start()
+    p_io.protocol_object.infinite_io_loop(reuse_port=True)
+
+
+# =========================================================================
+# start_workers(n, UpdatePublisher) -> [Process, ...]
+# =========================================================================
+def start_workers(workers, publisher):
+    # 'spawn': the workers do not inherit the threads and the connections of the crawler
+    context = multiprocessing.get_context('spawn')
+    processes = list()
+    for index in range(workers):
+        process = context.Process(target=worker_main, args=(index, publisher.path(), publisher.authkey()),
+                                  daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
@@ -6,11 +6,19 @@ import copy
 # #########################################################################
 # Storage class for shared resources (dictionary)
 # #########################################################################
+# Two concurrency modes:
+# - locked (default): every operation holds the lock
+# - copy_on_write: a write copies the dictionary and replaces it, the readers need no lock
+#   (a reader works always on an unchanged dictionary, the iterations are consistent snapshots;
+#    should be used for rarely written, often read dictionaries)
+# keys(), values() and items() return snapshots (lists) in both modes
+# =========================================================================
 class SharedDict:
 
     # =========================================================================
-    def __init__(self, dictionary=None):
+    def __init__(self, dictionary=None, copy_on_write=False):
         self.__lock = Lock()
+        self.__copy_on_write = copy_on_write
         if dictionary is not None:
             with self.__lock:
                 self.__storage = dictionary
@@ -22,6 +30,8 @@ class SharedDict:
 
     # =========================================================================
     def __getitem__(self, item):
+        if self.__copy_on_write:
+            return self.__storage[item]
         with self.__lock:
             value = self.__storage[item]
         return value
@@ -29,67 +39,111 @@ class SharedDict:
     # =========================================================================
     def __setitem__(self, key, value):
         with self.__lock:
-            self.__storage[key] = value
+            if self.__copy_on_write:
+                storage = dict(self.__storage)
+                storage[key] = value
+                self.__storage = storage
+            else:
+                self.__storage[key] = value
 
     # =========================================================================
     def __delitem__(self, key):
         with self.__lock:
-            del self.__storage[key]
+            if self.__copy_on_write:
+                storage = dict(self.__storage)
+                del storage[key]
+                self.__storage = storage
+            else:
+                del self.__storage[key]
 
     # =========================================================================
     def __len__(self):
+        if self.__copy_on_write:
+            return len(self.__storage)
         with self.__lock:
             length = len(self.__storage)
         return length
 
+    # =========================================================================
+    # update({key: value, ...})
+    # =========================================================================
+    # - stores several items with one copy (copy_on_write)
+    # =========================================================================
+    def update(self, items):
+        with self.__lock:
+            if self.__copy_on_write:
+                storage = dict(self.__storage)
+                storage.update(items)
+                self.__storage = storage
+            else:
+                self.__storage.update(items)
+
     # =========================================================================
     def pop(self, key):
         with self.__lock:
-            value = self.__storage.pop(key)
+            if self.__copy_on_write:
+                storage = dict(self.__storage)
+                value = storage.pop(key)
+                self.__storage = storage
+            else:
+                value = self.__storage.pop(key)
         return value
 
     # =========================================================================
     def get(self, key):
+        if self.__copy_on_write:
+            return self.__storage.get(key)
         with self.__lock:
             value = self.__storage.get(key)
         return value
 
     # =========================================================================
-    def keys(self):
+    # snapshot() -> dict
+    # =========================================================================
+    # - copy_on_write: the current (never modified) dictionary, otherwise a copy
+    # =========================================================================
+    def snapshot(self):
+        if self.__copy_on_write:
+            return self.__storage
         with self.__lock:
-            keys = self.__storage.keys()
-        return keys
+            storage = dict(self.__storage)
+        return storage
+
+    # =========================================================================
+    def keys(self):
+        return list(self.snapshot().keys())
 
     # =========================================================================
     def values(self):
-        with self.__lock:
-            values = self.__storage.values()
-        return values
+        return list(self.snapshot().values())
 
     # =========================================================================
     def items(self):
-        with self.__lock:
-            items = self.__storage.items()
-        return items
+        return list(self.snapshot().items())
 
     # =========================================================================
     def print(self):
-        with self.__lock:
-            print(self.__storage)
+        print(self.snapshot())
 
     # =========================================================================
     def json(self, key=None):
-        with self.__lock:
-            if key is None:
-                result = json.dumps(self.__storage)
-            else:
-                result = json.dumps(self.__storage[key])
+        storage = self.snapshot()
+        if key is None:
+            result = json.dumps(storage)
+        else:
+            result = json.dumps(storage[key])
         return result
 
+    # =========================================================================
+    # reset() -> dict
+    # =========================================================================
+    # - returns the storage before the reset
     # =========================================================================
     def reset(self):
         with self.__lock:
+            storage = self.__storage
             self.__storage = copy.deepcopy(self.__reset)
+        return storage
 
     # =========================================================================
     # result = dict(filter(lambda i: i[0] in SET, DICT.items()))
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from shared_storage import SharedDict
+
+# #########################################################################
+# SharedDict contention benchmark
+# #########################################################################
+# Many reader threads (like the websocket clients) and one writer thread
+# (like the wordpress client) work on the same SharedDict:
+# - the readers get posts by key and iterate over the keys (id_list)
+# - the writer adds and deletes posts (new and purged posts)
+# The operations per second are printed for both concurrency modes.
+# =========================================================================
+
+# TODO - can be set to the desired values
+POSTS = 3000
+READERS = 16
+DURATION = 2.0  # sec
+# every n-th read is an iteration over the keys
+ITERATE_EVERY = 100
+
+
+# =========================================================================
+def reader(storage, stop, counts, index):
+    reads = 0
+    errors = 0
+    while not stop.is_set():
+        try:
+            if reads % ITERATE_EVERY == 0:
+                for _ in storage.keys():
+                    pass
+            else:
+                storage.get(str(reads % POSTS))
+        except RuntimeError:
+            # dictionary changed size during iteration
+            errors += 1
+        reads += 1
+    counts[index] = (reads, errors)
+
+
+# =========================================================================
+def writer(storage, stop, counts):
+    writes = 0
+    while not stop.is_set():
+        # the keys POSTS .. 2 * POSTS are added in one round and deleted in the next one
+        key = str(POSTS + writes % POSTS)
+        if (writes // POSTS) % 2 == 0:
+            storage[key] = writes
+        else:
+            del storage[key]
+        writes += 1
+    counts['writes'] = writes
+
+
+# =========================================================================
+def benchmark(copy_on_write):
+    storage = SharedDict({str(key): key for key in range(POSTS)}, copy_on_write=copy_on_write)
+    stop = threading.Event()
+    counts = dict()
+    threads = [threading.Thread(target=reader, args=(storage, stop, counts, index)) for index in range(READERS)]
+    threads.append(threading.Thread(target=writer, args=(storage, stop, counts)))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    reads = sum(counts[index][0] for index in range(READERS))
+    errors = sum(counts[index][1] for index in range(READERS))
+    mode = 'copy_on_write' if copy_on_write else 'locked'
+    print(f'{mode:14} reads/s: {reads / DURATION:12.0f}  writes/s: {counts["writes"] / DURATION:10.0f}  '
+          f'iteration errors: {errors}')
+
+
+# =========================================================================
+# ENTRY POINT
+# =========================================================================
+if __name__ == '__main__':
+    print(f'{POSTS} posts, {READERS} readers, 1 writer, {DURATION} sec')
+    benchmark(False)
+    benchmark(True)
@@ -0,0 +1,77 @@
+import json
+import sqlite3
+
+import protocol_io as p_io
+from parser_pool import pack_words, unpack_words
+
+
+# #########################################################################
+# Snapshot store
+# #########################################################################
+# SQLite snapshot of the processed posts and the crawl cursor (for warm restarts)
+# - save() writes only the posts changed/deleted since the last save (one transaction)
+# - the WAL journal keeps the last committed snapshot valid after a crash
+# - load() restores the posts without parsing and returns the crawl cursor
+# =========================================================================
+class SnapshotStore:
+    # Size of the memory-mapped part of the database file (bytes)
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    # =========================================================================
+    def __init__(self, path):
+        # the connection is used only by the thread of the wordpress client
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=NORMAL')
+        self.__connection.execute(f'PRAGMA mmap_size={SnapshotStore.MMAP_SIZE}')
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS posts (id TEXT PRIMARY KEY, post_id INTEGER, '
+                                      'title TEXT, date TEXT, modify_date TEXT, status TEXT, content_hash TEXT, '
+                                      'words TEXT, counts BLOB)')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+
+    # =========================================================================
+    # save({cursor}) -> (saved, deleted) or None
+    # =========================================================================
+    # - None if the transaction failed (e.g. disk full, locked file),
+    #   then the changes are saved by the next call
+    # =========================================================================
+    def save(self, cursor):
+        posts, deleted_keys = p_io.protocol_object.take_snapshot_changes()
+        rows = list()
+        for post in posts:
+            words, counts = pack_words(post.words() or [])
+            rows.append((str(post.id()), post.id(), post.title(), post.date(), post.modify_date(), post.status(),
+                         post.content_hash(), words, counts))
+        try:
+            with self.__connection:
+                self.__connection.executemany('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                              rows)
+                self.__connection.executemany('DELETE FROM posts WHERE id = ?', [(key,) for key in deleted_keys])
+                self.__connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                                          ('cursor', json.dumps(cursor)))
+        except sqlite3.Error as error:
+            print('SnapshotStore: save error: ', error)
+            p_io.protocol_object.return_snapshot_changes(posts, deleted_keys)
+            return None
+        return len(rows), len(deleted_keys)
+
+    # =========================================================================
+    # load() -> {cursor} or None
+    # =========================================================================
+    def load(self):
+        posts = list()
+        for post_id, title, date, modify_date, status, content_hash, words, counts in self.__connection.execute(
+                'SELECT post_id, title, date, modify_date, status, content_hash, words, counts FROM posts'):
+            post = p_io.ProtocolData(post_id, title, date, modify_date, unpack_words((words, counts)), content_hash)
+            if status == p_io.ProtocolData.STS_MODIFIED:
+                post.mark_modified()
+            posts.append(post)
+        p_io.protocol_object.restore_posts(posts)
+
+        row = self.__connection.execute('SELECT value FROM state WHERE key = ?', ('cursor',)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    # =========================================================================
+    def close(self):
+        self.__connection.close()
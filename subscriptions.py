@@ -0,0 +1,79 @@
+# #########################################################################
+# Subscriptions
+# #########################################################################
+# Index of the client subscriptions (used by the websocket layer to route the broadcasts)
+# - a subscription is a (kind, value) pair, e.g. ('ids', '14333') or ('words', 'server')
+# - value -> clients index per kind: the routing cost depends on the changed values
+#   and the interested clients, not on the count of the connected clients
+# - the clients without any subscription receive every broadcast
+# - should be used only in the event loop
+# =========================================================================
+class SubscriptionIndex:
+
+    # =========================================================================
+    def __init__(self):
+        # kind -> {value: {client, ...}}
+        self.__index = dict()
+        # client -> {(kind, value), ...}
+        self.__clients = dict()
+
+    # =========================================================================
+    def subscribe(self, client, kind, values):
+        subscribers = self.__index.setdefault(kind, dict())
+        subscriptions = self.__clients.setdefault(client, set())
+        for value in values:
+            subscribers.setdefault(value, set()).add(client)
+            subscriptions.add((kind, value))
+
+    # =========================================================================
+    # unsubscribe(client, kind, values)
+    # =========================================================================
+    # - every subscription of the client is removed if kind is None
+    # =========================================================================
+    def unsubscribe(self, client, kind=None, values=None):
+        subscriptions = self.__clients.get(client)
+        if subscriptions is None:
+            return
+        if kind is None:
+            removed = list(subscriptions)
+        else:
+            removed = [(kind, value) for value in values if (kind, value) in subscriptions]
+        for kind, value in removed:
+            subscriptions.discard((kind, value))
+            subscribers = self.__index[kind]
+            subscribers[value].discard(client)
+            if not subscribers[value]:
+                del subscribers[value]
+        if not subscriptions:
+            del self.__clients[client]
+
+    # =========================================================================
+    def is_subscribed(self, client):
+        return client in self.__clients
+
+    # =========================================================================
+    def has_subscribers(self, kind):
+        return bool(self.__index.get(kind))
+
+    # =========================================================================
+    # route(kind, [(value, key), ...], routed) -> routed
+    # =========================================================================
+    # - collects the keys per interested client: {client: {key, ...}, ...}
+    # =========================================================================
+    def route(self, kind, items, routed=None):
+        if routed is None:
+            routed = dict()
+        subscribers = self.__index.get(kind)
+        if not subscribers:
+            return routed
+        for value, key in items:
+            clients = subscribers.get(value)
+            if clients:
+                for client in clients:
+                    routed.setdefault(client, set()).add(key)
+        return routed
+
+    # =========================================================================
+    def stats(self):
+        return {'clients': len(self.__clients),
+                'values': {kind: len(subscribers) for kind, subscribers in self.__index.items()}}
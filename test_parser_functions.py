@@ -0,0 +1,95 @@
+import pytest
+
+import parser_functions as parser
+
+
+# #########################################################################
+# Golden outputs of the parser
+# #########################################################################
+# The expected values were captured from the original parser
+# (regex filter_word and BeautifulSoup based parse_json),
+# the memoized tokenizer and the streaming extractor must return the same words and counts.
+# =========================================================================
+
+FILTER_WORD_CASES = [
+    ('Größe', ['größe']),
+    ('STRAßE', ['straße']),
+    ('Äpfel,', ['äpfel']),
+    ('Übung!', ['übung']),
+    ('ÖL', ['öl']),
+    ('ß', ['ß']),
+    ('z.B.', ['z.b.']),
+    ('u.a.', ['u.a.']),
+    ('a.b.c', ['a.b.c']),
+    ('Ende.', ['ende']),
+    ('Hallo...', ['hallo...']),
+    ('...', []),
+    ('3.5', []),
+    ('v1.2.3.', ['v1.2.3.']),
+    ('E-Mail', ['e-mail']),
+    ('E-Mail-Adresse', ['e-mail-adresse']),
+    ('Top-10-Liste', ['top', '10', 'liste']),
+    ('Nord-', ['nord']),
+    ('-Süd', ['süd']),
+    ('e-', ['e']),
+    ('A-B-', ['a-b']),
+    ('x--y', ['x--y']),
+    ('--', []),
+    ('–', []),
+    ('2021-10-01', []),
+    ('10:30', []),
+    ('Preis:', ['preis']),
+    ('(Hallo)', ['hallo']),
+    ('"Zitat"', ['zitat']),
+    ('„Anführung“', ['anführung']),
+    ('WordPress/PHP', ['wordpressphp']),
+    ('foo?bar', ['foobar']),
+]
+
+PARSE_JSON_CASES = [
+    ('<p>Die Größe der Straße, z.B. in München.</p>',
+     [('der', 1), ('die', 1), ('größe', 1), ('in', 1), ('münchen', 1), ('straße', 1), ('z.b.', 1)]),
+    ('<b>I</b><span style="font-weight: 300;">ntegration</span> und <strong>V</strong>olatility',
+     [('integration', 1), ('und', 1), ('volatility', 1)]),
+    ('<h2>E-Mail-Adresse</h2><p>Nord- und Südseite; u.a. Übung!</p>',
+     [('e-mail-adresse', 1), ('nord', 1), ('südseite', 1), ('u.a.', 1), ('und', 1), ('übung', 1)]),
+    ('<p>Text</p><script>var x = "nicht zählen";</script><style>.a{color:red}</style><p>Text ende.</p>',
+     [('ende', 1), ('text', 2)]),
+    ('<p>Hallo&nbsp;Welt &amp; mehr &uuml;ber &#246;l</p><br/><p>Top-10-Liste: 3.5 Punkte</p>',
+     [('10', 1), ('hallo', 1), ('liste', 1), ('mehr', 1), ('punkte', 1), ('top', 1), ('welt', 1), ('öl', 1),
+      ('über', 1)]),
+    ('<ul><li>eins</li><li>zwei</li><li>eins</li></ul><!-- kommentar --><p>ÄÖÜ äöü ß</p>',
+     [('eins', 2), ('zwei', 1), ('ß', 1), ('äöü', 2)]),
+]
+
+# Intended difference from the original parser: the tag names are case-insensitive
+# (the original regex rewrite matched only the lowercase inline tags, then the fragments were separate words)
+UPPERCASE_TAG_CASES = [
+    ('<SPAN>I</SPAN><SPAN>ntegration</SPAN>', [('integration', 1)]),
+    ('<STRONG>V</STRONG>olatility', [('volatility', 1)]),
+    ('<B>I</B><SPAN style="font-weight: 300;">ntegration</SPAN>', [('integration', 1)]),
+]
+
+
+# =========================================================================
+@pytest.mark.parametrize('token, expected', FILTER_WORD_CASES)
+def test_filter_word(token, expected):
+    assert parser.filter_word(token) == expected
+
+
+# =========================================================================
+@pytest.mark.parametrize('content, expected', PARSE_JSON_CASES + UPPERCASE_TAG_CASES)
+def test_parse_json(content, expected):
+    assert parser.parse_json(content)['words'] == expected
+
+
+# =========================================================================
+def test_word_counter_batches():
+    # the counts do not depend on how the text is split into batches (see TextExtractor.FEED_SIZE)
+    text = ' '.join(token for token, expected in FILTER_WORD_CASES)
+    word_counter = parser.WordCounter()
+    for token in text.split():
+        word_counter.feed(token)
+    expected = parser.WordCounter()
+    expected.feed(text)
+    assert word_counter.words() == expected.words()
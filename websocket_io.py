@@ -1,10 +1,87 @@
 import asyncio
+from collections import deque
+
 import websockets
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+import wire_encoding
+from subscriptions import SubscriptionIndex
 
 
 # #########################################################################
 # Websocket I/O
 # #########################################################################
+
+# =========================================================================
+# class ClientQueue
+# =========================================================================
+# Bounded outbound queue of a client (for the broadcast messages)
+# - the messages are sent by a separate task, a slow client blocks only its own task
+# - the messages are encoded just before sending (see wire_encoding.py)
+# - if the queue is full, the policy decides:
+#   COALESCE   : the pending messages and the new one are merged into one message
+#   DROP_OLDEST: the oldest pending message is dropped
+#   DISCONNECT : the client is disconnected
+# =========================================================================
+class ClientQueue:
+    COALESCE = 'coalesce'
+    DROP_OLDEST = 'drop_oldest'
+    DISCONNECT = 'disconnect'
+
+    # =========================================================================
+    def __init__(self, websocket, max_size, policy, merge_fn, encode_fn):
+        self.__websocket = websocket
+        self.__encode_fn = encode_fn
+        self.__max_size = max_size
+        self.__policy = policy
+        self.__merge_fn = merge_fn
+        self.__messages = deque()
+        self.__event = asyncio.Event()
+        self.__dropped = 0
+        self.__coalesced = 0
+        self.__task = asyncio.ensure_future(self.__sender())
+
+    # =========================================================================
+    # put(message) -> False if the client should be disconnected
+    # =========================================================================
+    def put(self, message):
+        if len(self.__messages) >= self.__max_size:
+            if self.__policy == ClientQueue.DISCONNECT:
+                return False
+            if self.__policy == ClientQueue.COALESCE and self.__merge_fn is not None:
+                self.__coalesced += len(self.__messages)
+                message = self.__merge_fn(list(self.__messages) + [message])
+                self.__messages.clear()
+            else:
+                self.__messages.popleft()
+                self.__dropped += 1
+        self.__messages.append(message)
+        self.__event.set()
+        return True
+
+    # =========================================================================
+    async def __sender(self):
+        try:
+            while True:
+                await self.__event.wait()
+                self.__event.clear()
+                while self.__messages:
+                    await self.__websocket.send(self.__encode_fn(self.__messages.popleft()))
+        except websockets.WebSocketException as error:
+            print("WebsocketIO io error: ", error)
+
+    # =========================================================================
+    def cancel(self):
+        self.__task.cancel()
+
+    # =========================================================================
+    def stats(self):
+        return {'depth': len(self.__messages), 'dropped': self.__dropped, 'coalesced': self.__coalesced}
+
+
+# =========================================================================
+# class WebsocketIO
+# =========================================================================
 class WebsocketIO:
     # TODO - Timeout for Client communication
     #  - currently the clients should answer to the broadcast messages
@@ -13,16 +90,63 @@ class WebsocketIO:
     #    (in this case timeout will be not needed anymore)
     TIMEOUT = 600.00  # sec
 
+    # Maximal number of the requests in process per client
+    # TODO - can be set to the desired value between 1 .. n
+    #  (if the limit is reached, the next message is received only after an answer was sent)
+    MAX_IN_FLIGHT = 16
+
+    # Outbound queue (broadcast messages) per client
+    # TODO - can be set to the desired values
+    #  QUEUE_SIZE  : maximal number of the pending broadcast messages of a client
+    #  QUEUE_POLICY: ClientQueue.COALESCE / DROP_OLDEST / DISCONNECT (see ClientQueue)
+    QUEUE_SIZE = 16
+    QUEUE_POLICY = ClientQueue.COALESCE
+
+    # permessage-deflate (negotiated with the clients)
+    # TODO - can be set to the desired values
+    #  WINDOW_BITS: 8 .. 15, a larger window compresses the large messages slightly better,
+    #               but needs more memory per client (the default of websockets is 12)
+    #  MEM_LEVEL  : 1 .. 9, memory of the compressor per client
+    #  LEVEL      : 1 (fast) .. 9 (small), the word lists are compressed to ~1/3 with level 6
+    DEFLATE_WINDOW_BITS = 12
+    DEFLATE_MEM_LEVEL = 5
+    DEFLATE_LEVEL = 6
+
     # =========================================================================
-    def __init__(self, protocol_callback_fn):
+    # - protocol_callback_fn(message, client) -> answer or None
+    #   (client is the websocket, it identifies the client by the subscriptions)
+    # - offload_fn(message) -> True if the callback is expensive for this message
+    #   (it is called in a thread instead of the event loop)
+    # - merge_fn([message, ...]) -> message (merges broadcast messages, see ClientQueue)
+    # =========================================================================
+    def __init__(self, protocol_callback_fn, offload_fn=None, merge_fn=None):
         self.__TIMEOUT = 600.00  # sec
         self.__clients = set()
         self.__protocol_callback_fn = protocol_callback_fn
+        self.__offload_fn = offload_fn
+        self.__merge_fn = merge_fn
+        self.__loop = None
+        self.__queues = dict()
+        self.__disconnected = 0
+        self.__encoder = wire_encoding.WireEncoder()
+        self.__subscriptions = SubscriptionIndex()
 
     # =========================================================================
-    def start_server(self):
+    # =========================================================================
+    # start_server(reuse_port)
+    # =========================================================================
+    # - reuse_port: several processes can serve on the same port (see server_workers.py)
+    # =========================================================================
+    def start_server(self, reuse_port=False):
         loop = asyncio.get_event_loop()
-        start_server = websockets.serve(self.__handler, "localhost", 8000)
+        self.__loop = loop
+        deflate = ServerPerMessageDeflateFactory(server_max_window_bits=WebsocketIO.DEFLATE_WINDOW_BITS,
+                                                 client_max_window_bits=WebsocketIO.DEFLATE_WINDOW_BITS,
+                                                 compress_settings={'memLevel': WebsocketIO.DEFLATE_MEM_LEVEL,
+                                                                    'level': WebsocketIO.DEFLATE_LEVEL})
+        start_server = websockets.serve(self.__handler, "localhost", 8000,
+                                        subprotocols=wire_encoding.subprotocols(), extensions=[deflate],
+                                        reuse_port=reuse_port)
         loop.run_until_complete(start_server)
         loop.run_forever()
 
@@ -30,50 +154,175 @@ class WebsocketIO:
     def get_client_count(self):
         return len(self.__clients)
 
+    # =========================================================================
+    # call_soon_threadsafe(callback, *args) -> bool
+    # =========================================================================
+    # - the callback is called in the event loop (can be called from any thread)
+    # - returns False if the server is not running
+    # =========================================================================
+    def call_soon_threadsafe(self, callback, *args):
+        if self.__loop is None:
+            return False
+        self.__loop.call_soon_threadsafe(callback, *args)
+        return True
+
+    # =========================================================================
+    # call_later(delay, callback, *args)
+    # =========================================================================
+    # - should be called only in the event loop
+    # =========================================================================
+    def call_later(self, delay, callback, *args):
+        return self.__loop.call_later(delay, callback, *args)
+
+    # =========================================================================
+    # broadcast(message)
+    # =========================================================================
+    # - can be called from any thread, the message is queued in the event loop
+    # - the message is sent to the clients without subscriptions (see send)
     # =========================================================================
     def broadcast(self, message):
-        if self.__clients:
-            websockets.broadcast(self.__clients, message)
+        if self.__clients and self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__enqueue, message)
+
+    # =========================================================================
+    def __enqueue(self, message):
+        for websocket, queue in list(self.__queues.items()):
+            if not self.__subscriptions.is_subscribed(websocket):
+                self.__put(websocket, queue, message)
+
+    # =========================================================================
+    # send(client, message)
+    # =========================================================================
+    # - queues a message for one client (e.g. the routed broadcasts of a subscribed client)
+    # - should be called only in the event loop
+    # =========================================================================
+    def send(self, client, message):
+        queue = self.__queues.get(client)
+        if queue is not None:
+            self.__put(client, queue, message)
+
+    # =========================================================================
+    def __put(self, websocket, queue, message):
+        if not queue.put(message):
+            # the client is too slow...
+            self.__disconnected += 1
+            queue.cancel()
+            del self.__queues[websocket]
+            asyncio.ensure_future(websocket.close(1008, 'outbound queue overflow'))
+
+    # =========================================================================
+    # Subscriptions (see subscriptions.py)
+    # =========================================================================
+    # - should be called only in the event loop
+    # =========================================================================
+    def subscribe(self, client, kind, values):
+        self.__subscriptions.subscribe(client, kind, values)
+
+    def unsubscribe(self, client, kind=None, values=None):
+        self.__subscriptions.unsubscribe(client, kind, values)
+
+    def has_subscribers(self, kind):
+        return self.__subscriptions.has_subscribers(kind)
+
+    def route(self, kind, items, routed=None):
+        return self.__subscriptions.route(kind, items, routed)
+
+    def get_subscription_stats(self):
+        return self.__subscriptions.stats()
+
+    # =========================================================================
+    # get_queue_stats() -> dict
+    # =========================================================================
+    # {'clients': {'remote address': {'depth': n, 'dropped': n, 'coalesced': n}, ...}, 'disconnected': n}
+    # =========================================================================
+    def get_queue_stats(self):
+        clients = {str(websocket.remote_address): queue.stats() for websocket, queue in list(self.__queues.items())}
+        return {'clients': clients, 'disconnected': self.__disconnected}
+
+    # =========================================================================
+    # get_encoding_stats() -> dict
+    # =========================================================================
+    # sent messages, bytes (before compression) and encode time per encoding and message type (see WireEncoder)
+    # =========================================================================
+    def get_encoding_stats(self):
+        return self.__encoder.stats()
 
     # =========================================================================
     async def __register(self, websocket):
+        encoding = wire_encoding.encoding_of(websocket.subprotocol)
         self.__clients.add(websocket)
+        self.__queues[websocket] = ClientQueue(websocket, WebsocketIO.QUEUE_SIZE, WebsocketIO.QUEUE_POLICY,
+                                               self.__merge_fn,
+                                               lambda message: self.__encoder.encode(message, encoding,
+                                                                                     wire_encoding.NOTIFY))
         # await notify_clients()
         print(f'WebsocketIO: \'{websocket}\' is registered and opened')
 
     # =========================================================================
     async def __unregister(self, websocket):
         self.__clients.remove(websocket)
+        self.__subscriptions.unsubscribe(websocket)
+        queue = self.__queues.pop(websocket, None)
+        if queue is not None:
+            queue.cancel()
         await websocket.close()
         # await notify_clients()
         print(f'WebsocketIO: \'{websocket}\' is unregistered and closed')
 
+    # =========================================================================
+    async def __process(self, websocket, message, in_flight):
+        try:
+            # the protocol works with JSON texts
+            encoding = wire_encoding.encoding_of(websocket.subprotocol)
+            message = self.__encoder.decode(message, encoding)
+            if message is None:
+                return
+            # Let the protocol process the received message and return an answer
+            # see protocol_io.py for details
+            # - the expensive requests are processed in a thread (the event loop is not blocked)
+            if self.__offload_fn is not None and self.__offload_fn(message):
+                loop = asyncio.get_event_loop()
+                answer = await loop.run_in_executor(None, self.__protocol_callback_fn, message, websocket)
+            else:
+                answer = self.__protocol_callback_fn(message, websocket)
+            if answer is not None:
+                # send the answer to the client
+                await websocket.send(self.__encoder.encode(answer, encoding))
+
+                print('answer :', answer)
+
+        except websockets.WebSocketException as error:
+            print("WebsocketIO io error: ", error)
+        except Exception as error:
+            # a bad frame or a protocol failure must not end as an unretrieved task exception
+            print(f'WebsocketIO: error by processing \'{message}\': {error!r}')
+        finally:
+            in_flight.release()
+
     # =========================================================================
     async def __handler(self, websocket, path):
         # register(websocket) sends client_event() to websocket
         await self.__register(websocket)
 
+        # the requests of the client are processed concurrently (at most MAX_IN_FLIGHT)
+        in_flight = asyncio.Semaphore(WebsocketIO.MAX_IN_FLIGHT)
+        tasks = set()
         try:
             while True:
                 message = await asyncio.wait_for(websocket.recv(), WebsocketIO.TIMEOUT)
 
                 print('message:', message)
 
-                # Let the protocol process the received message and return an answer
-                # see protocol_io.py for details
-                answer = self.__protocol_callback_fn(message)
-                if answer is not None:
-                    # send the answer to the client
-                    await websocket.send(answer)
-
-                    print('answer :', answer)
-
-                # sleep, to allow other message loops to do their jobs...
-                await asyncio.sleep(0.250)
+                await in_flight.acquire()
+                task = asyncio.ensure_future(self.__process(websocket, message, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
         except websockets.WebSocketException as error:
             print("WebsocketIO io error: ", error)
         except asyncio.TimeoutError as error:
             print("WebsocketIO timeout: ", error)
         finally:
+            for task in list(tasks):
+                task.cancel()
             await self.__unregister(websocket)
@@ -0,0 +1,179 @@
+import json
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# orjson and msgpack are optional
+# - orjson: faster JSON serialization (compact output, without spaces)
+# - msgpack: binary encoding for the clients which request it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# #########################################################################
+# Wire encoding
+# #########################################################################
+# The protocol creates JSON texts, the websocket layer sends them in the encoding
+# negotiated with the client (websocket subprotocol):
+# - 'wordcount.json'   : JSON text frames (also without subprotocol)
+# - 'wordcount.msgpack': MessagePack binary frames (requests and answers)
+# =========================================================================
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+SUBPROTOCOLS = {'wordcount.json': JSON, 'wordcount.msgpack': MSGPACK}
+
+# Message types of the stats: the 'ack' of the answers, NOTIFY for the change notifications
+NOTIFY = 'notify'
+OTHER = 'other'
+# the 'ack' is at the beginning of the answers (after the optional 'req_id')
+ack_pattern = re.compile(r'"ack":\s*"(\w{1,32})"')
+ACK_SEARCH_LENGTH = 256
+
+
+# =========================================================================
+# message_type_of(string) -> string
+# =========================================================================
+# - the answers are created only for the known requests, the types are limited
+# =========================================================================
+def message_type_of(message):
+    match = ack_pattern.search(message, 0, ACK_SEARCH_LENGTH)
+    return match.group(1) if match is not None else OTHER
+
+
+# =========================================================================
+# dumps(object) -> string
+# =========================================================================
+# - compact (without spaces) and not ASCII-escaped, with and without orjson
+#   (the answers built from serialized parts use the same separators, see protocol_io.py)
+# =========================================================================
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+# =========================================================================
+# loads(string) -> object
+# =========================================================================
+# - raises json.JSONDecodeError (orjson.JSONDecodeError is derived from it)
+# =========================================================================
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+# =========================================================================
+# subprotocols() -> [string, ...]
+# =========================================================================
+# - the subprotocols offered to the clients (only with installed packages)
+# =========================================================================
+def subprotocols():
+    return [name for name, encoding in SUBPROTOCOLS.items() if encoding != MSGPACK or msgpack is not None]
+
+
+# =========================================================================
+def encoding_of(subprotocol):
+    return SUBPROTOCOLS.get(subprotocol, JSON)
+
+
+# =========================================================================
+# class WireEncoder
+# =========================================================================
+# Converts the JSON texts into the encoding of the client (and the requests back)
+# - the encoded messages are cached by the text (the cached answers and the
+#   broadcast messages are the same string objects for every client)
+# - encode time and bytes are counted per encoding and per message type (see stats)
+# - encode/decode should be used only in the event loop, stats() can be called from any thread
+# =========================================================================
+class WireEncoder:
+    # Number of the cached encoded messages
+    CACHE_SIZE = 64
+
+    # =========================================================================
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.__cache_size = cache_size
+        self.__cache = OrderedDict()
+        # the stats are also read by other threads (e.g. main_loop)
+        self.__stats_lock = Lock()
+        self.__stats = dict()
+
+    # =========================================================================
+    # encode(string, encoding, message type) -> string or bytes
+    # =========================================================================
+    # - without message type the type is taken from the 'ack' of the answer (see message_type_of)
+    # =========================================================================
+    def encode(self, message, encoding, message_type=None):
+        if message_type is None:
+            message_type = message_type_of(message)
+        if encoding == JSON:
+            self.__count(encoding, message_type, len(message) if message.isascii() else len(message.encode('utf-8')))
+            return message
+
+        key = (encoding, message)
+        encoded = self.__cache.get(key)
+        if encoded is not None:
+            self.__cache.move_to_end(key)
+            self.__count(encoding, message_type, len(encoded), cached=True)
+        else:
+            start = time.perf_counter()
+            encoded = msgpack.packb(loads(message))
+            encode_time = time.perf_counter() - start
+            self.__cache[key] = encoded
+            if len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+            self.__count(encoding, message_type, len(encoded), encode_time)
+        return encoded
+
+    # =========================================================================
+    def __count(self, encoding, message_type, size, encode_time=0.0, cached=False):
+        with self.__stats_lock:
+            stats = self.__stats.setdefault(encoding, {'messages': 0, 'bytes': 0, 'encode_time': 0.0, 'cached': 0,
+                                                       'types': dict()})
+            type_stats = stats['types'].setdefault(message_type, {'messages': 0, 'bytes': 0, 'encode_time': 0.0})
+            stats['messages'] += 1
+            stats['bytes'] += size
+            stats['encode_time'] += encode_time
+            type_stats['messages'] += 1
+            type_stats['bytes'] += size
+            type_stats['encode_time'] += encode_time
+            if cached:
+                stats['cached'] += 1
+
+    # =========================================================================
+    # decode(string or bytes, encoding) -> string or None
+    # =========================================================================
+    # - None if the message cannot be converted into a JSON text
+    # =========================================================================
+    def decode(self, message, encoding):
+        if encoding == MSGPACK and isinstance(message, bytes):
+            try:
+                return dumps(msgpack.unpackb(message))
+            except (ValueError, TypeError) as error:
+                # invalid frame, or bytes values / non-string keys (not representable in JSON)
+                print(f'WireEncoder: decode error: {error}')
+                return None
+        return message
+
+    # =========================================================================
+    # stats() -> dict
+    # =========================================================================
+    # {'json': {'messages': n, 'bytes': n, 'encode_time': sec, 'cached': n,
+    #           'types': {'post': {'messages': n, 'bytes': n, 'encode_time': sec}, 'notify': {...}, ...}},
+    #  'msgpack': {...}}
+    # - bytes: the encoded messages, the permessage-deflate compression is done later by the
+    #   websockets package and is not counted (it does not expose the compressed frame sizes)
+    # =========================================================================
+    def stats(self):
+        with self.__stats_lock:
+            return {encoding: dict(stats, types={message_type: dict(type_stats)
+                                                 for message_type, type_stats in stats['types'].items()})
+                    for encoding, stats in self.__stats.items()}
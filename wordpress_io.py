@@ -1,31 +1,74 @@
 import requests
 import base64
+import time
 from datetime import datetime
+from threading import Lock
 
 import parser_functions as parser
 import protocol_io as p_io
+from crawl_control import CrawlController
+from parser_pool import ParserPool
+from performance_timer import metrics
+from http_io import HttpFetcher, AsyncHttpFetcher, ResponseCache, FETCH_ERRORS
 
 # #########################################################################
 # WordPress I/O
 # #########################################################################
 
-# ~Update period for the Wordpress GET-s
+# ~Maximal update period for the Wordpress GET-s
+# (the poll interval grows until this period while no post is changed, see main.py)
 # TODO - can be set to the desired value between 1 .. n (seconds)
 UPDATE_PERIOD = 10.00  # sec
 
-# Posts per page for GET.
+# Posts per page for GET (initial value if ADAPTIVE_CRAWL is set).
 # TODO - can be set to the desired value between 1 .. 100 (posts per page)
 POST_PER_PAGE = 3
 
-# Maximal number of GETs in one function loop.
+# Maximal number of GETs in one function loop (initial value if ADAPTIVE_CRAWL is set).
 # TODO - can be set to the desired value between 1 .. n  (but be careful...)
 #  selected number of GETs will be dispatched between the threads
 #  (As default we have  4 + CPU-logical-cores  threads in the pool)
 PAGE_PER_LOOP_LIMIT = 16
 
+# Adaptive page size and GETs per loop (see crawl_control.py)
+# - tuned from the observed latencies, errors and 429/5xx responses
+# - between 1 .. MAX_POST_PER_PAGE posts per page and 1 .. MAX_PAGE_PER_LOOP GETs per loop
+ADAPTIVE_CRAWL = True
+MAX_POST_PER_PAGE = 100
+MAX_PAGE_PER_LOOP = 32
+
+# Posts per page for the deletion check.
+# TODO - can be set to the desired value between 1 .. 100 (posts per page)
+#  the deletion check requests only the id-s, therefore the maximal page size is used
+CHECK_PER_PAGE = 100
+
+# Requested fields of the posts per task (_fields=...)
+# - 'parse'    : everything what is stored by process_posts
+# - 'del_check': only the id-s
+TASK_FIELDS = {
+    'parse': 'id,title,date,modified,modified_gmt,content',
+    'del_check': 'id'
+}
+
 # The used URL...
 URL = 'https://www.thekey.academy/wp-json/wp/v2/posts'
 
+# Kept-alive connections to the WordPress host.
+# TODO - can be set to the desired value between 1 .. n
+#  (should be at least PAGE_PER_LOOP_LIMIT, otherwise some connections will not be reused)
+POOL_SIZE = 32
+
+# Use the asyncio fetcher: one thread keeps every GET of a loop in flight,
+# the parse step is dispatched between the threads afterwards.
+# TODO - needs aiohttp
+ASYNC_FETCH = False
+
+# Number of parser processes (the posts of the 'parse' tasks are parsed in a process pool)
+# TODO - can be set to the desired value between 0 .. n
+#  None: CPU-logical-cores processes
+#  0   : the posts are parsed by the threads themselves (without process pool)
+PARSE_WORKERS = None
+
 # =========================================================================
 # Other WP constants and variables
 # =========================================================================
@@ -35,6 +78,7 @@ STS_IO_ERROR = -3
 STS_RESPONSE_ERROR = -2
 STS_JSON_ERROR = -1
 STS_OK = 0
+STS_NOT_MODIFIED = 1
 
 # State of the result - Result state for the returned status with synchronized values
 # E.g. if status of operation is -1 : STS_JSON_ERROR --> ST_GLOBAL_HEADER_OK
@@ -55,19 +99,167 @@ result_pages = 1
 # page variables for the posts
 current_page = 1
 pages = 1
-# page variables for the del_test
-check_page = 1
+# page count for the del_check (every page is requested in one loop)
 check_pages = 1
 # datetime filter
 modified_after = ''
 # headers
 headers = list()
+# received bytes and json decode time per task (for the whole run)
+payload_totals = dict()
+
+# Basic authentication and the other request headers (computed only once)
+AUTH_HEADER = 'Basic ' + base64.b64encode(b'guest:').decode('ascii')
+REQUEST_HEADERS = {'User-Agent': 'Custom', 'Authorization': AUTH_HEADER}
+
+# Shared connection pool(s), used by every GET
+fetcher = HttpFetcher(REQUEST_HEADERS)
+fetcher.set_pool_size(URL, POOL_SIZE)
+async_fetcher = None
+
+# Conditional GET cache (ETag / Last-Modified), the key is the GET-header (query string)
+response_cache = ResponseCache()
+
+# Parser processes, created at first use
+parser_pool = None
+parser_pool_lock = Lock()
+
+# Page size and GETs per loop
+crawl_controller = CrawlController(POST_PER_PAGE, PAGE_PER_LOOP_LIMIT, MAX_POST_PER_PAGE, MAX_PAGE_PER_LOOP,
+                                   ADAPTIVE_CRAWL)
+
+
+# =========================================================================
+# get_async_fetcher() -> AsyncHttpFetcher
+# =========================================================================
+def get_async_fetcher():
+    global async_fetcher
+    # created at first use (aiohttp is optional)
+    if async_fetcher is None:
+        async_fetcher = AsyncHttpFetcher(REQUEST_HEADERS, POOL_SIZE)
+    return async_fetcher
+
+
+# =========================================================================
+# get_parser_pool() -> ParserPool
+# =========================================================================
+def get_parser_pool():
+    global parser_pool
+    # the threads of the executor can call it parallel
+    with parser_pool_lock:
+        if parser_pool is None:
+            parser_pool = ParserPool(PARSE_WORKERS)
+    return parser_pool
+
+
+# =========================================================================
+# fetch_stats() -> dict
+# =========================================================================
+def fetch_stats():
+    # connection reuse counts per host
+    result = fetcher.stats()
+    if async_fetcher is not None:
+        result['async'] = async_fetcher.stats()
+    return result
+
+
+# =========================================================================
+# cache_stats() -> dict
+# =========================================================================
+def cache_stats():
+    # hits / misses / bytes_saved of the conditional GETs
+    return response_cache.stats()
+
+
+# =========================================================================
+# task_header(string, string) -> string
+# =========================================================================
+def task_header(task, parameters):
+    # request only the fields needed by the task
+    return f"?_fields={TASK_FIELDS[task]}&" + parameters
+
+
+# =========================================================================
+# crawl_state() -> dict
+# =========================================================================
+def crawl_state():
+    # current page size, GETs per loop and the reason of the last decision
+    return crawl_controller.state()
 
 
 # =========================================================================
-# get_posts(string) -> dict
+# payload_stats() -> dict
+# =========================================================================
+def payload_stats():
+    # {'parse': {'pages': n, 'bytes': n, 'decode_time': sec}, ...}
+    return {task: dict(totals) for task, totals in payload_totals.items()}
+
+
+# =========================================================================
+# crawl_cursor() -> dict
+# =========================================================================
+# - the crawl position and the date watermarks (stored in the snapshot, see snapshot_store.py)
+# =========================================================================
+def crawl_cursor():
+    return {'latest_date': str(latest_date) if latest_date is not None else None,
+            'latest_modify_date': str(latest_modify_date) if latest_modify_date is not None else None,
+            'polling': modified_after != '',
+            'all_result_posts': all_result_posts,
+            'result_posts': result_posts,
+            'check_pages': check_pages,
+            'current_page': current_page,
+            'per_page': crawl_controller.per_page(),
+            # the failed pages, they are requested again
+            'headers': list(headers)}
+
+
 # =========================================================================
-def get_posts(header_parameters):
+# restore_cursor(dict)
+# =========================================================================
+# - after a full crawl the client continues with the datetime filter,
+#   otherwise with the next (not received) page
+# - the failed pages of the cursor are requested again
+# =========================================================================
+def restore_cursor(cursor):
+    global latest_date
+    global latest_modify_date
+    global modified_after
+    global all_result_posts
+    global result_posts
+    global result_pages
+    global check_pages
+    global current_page
+    global pages
+    global headers
+
+    if cursor['latest_date'] is not None:
+        latest_date = datetime.fromisoformat(cursor['latest_date'])
+    if cursor['latest_modify_date'] is not None:
+        latest_modify_date = datetime.fromisoformat(cursor['latest_modify_date'])
+    all_result_posts = cursor['all_result_posts']
+    result_posts = cursor['result_posts']
+    check_pages = cursor['check_pages']
+    if cursor['polling'] and latest_modify_date is not None:
+        modified_after = f"&modified_after={latest_modify_date}"
+    else:
+        # the page size can be different now
+        per_page = crawl_controller.per_page()
+        current_page = (cursor['current_page'] - 1) * cursor['per_page'] // per_page + 1
+        result_pages = max(-(-result_posts // per_page), 1)
+        pages = result_pages
+    # (older snapshots have no headers)
+    headers = list(cursor.get('headers', []))
+
+
+# =========================================================================
+# get_posts(string, response) -> dict
+# =========================================================================
+# - if the response is not given, the GET is done by the shared fetcher
+# - otherwise the response (or the exception) of an earlier GET is evaluated
+# - the GET is conditional if the response_cache has an entry for the header,
+#   by a 304 response the status is STS_NOT_MODIFIED and the cached values are returned
+# =========================================================================
+def get_posts(header_parameters, entry=None):
     result = {
         # Result status of operation
         'status': STS_UNKNOWN_ERROR,
@@ -75,15 +267,36 @@ def get_posts(header_parameters):
         'total_posts': 0,
         'total_pages': 0,
         # Result as json object
-        'json': dict()
+        'json': dict(),
+        # ETag / Last-Modified of the response
+        'validators': None,
+        # Size of the response and time of the json decode
+        'size': 0,
+        'decode_time': 0.0,
+        # HTTP status and latency of the GET (None without response)
+        'http_status': None,
+        'latency': None
     }
 
-    # Compute basic authentication header
-    auth_header = b"Basic " + base64.b64encode(b"guest:")
-
     try:
         # GET-Request
-        entry = requests.get(URL + header_parameters, headers={'User-Agent': 'Custom', 'Authorization': auth_header})
+        if entry is None:
+            entry = fetcher.get(URL + header_parameters, response_cache.request_headers(header_parameters))
+        elif isinstance(entry, Exception):
+            raise entry
+        result['http_status'] = entry.status_code
+        result['latency'] = entry.elapsed.total_seconds()
+        # Not modified since the last GET?
+        if entry.status_code == 304:
+            found, cached = response_cache.not_modified(header_parameters)
+            if found:
+                result['total_posts'] = cached['total_posts']
+                result['total_pages'] = cached['total_pages']
+                result['json'] = cached['json']
+                result['status'] = STS_NOT_MODIFIED
+                return result
+        else:
+            response_cache.modified(header_parameters)
         # Response check
         if entry.status_code >= 300:
             print("Error code: ", entry.status_code)
@@ -96,28 +309,54 @@ def get_posts(header_parameters):
         result['total_pages'] = int(entry.headers.get('X-WP-TotalPages'))
 
         # convert entry to json
+        decode_start = time.perf_counter()
         entry_json_list = entry.json()
+        result['decode_time'] = time.perf_counter() - decode_start
+        result['size'] = len(entry.content)
         result['json'] = entry_json_list
+        result['validators'] = ResponseCache.validators(entry)
         # status is OK
         result['status'] = STS_OK
         return result
 
-    except IOError as error:
-        print("Wordpress: IO Error: ", error)
-        result['status'] = STS_RESPONSE_ERROR
-    except (requests.exceptions.InvalidJSONError, requests.exceptions.JSONDecodeError, TypeError) as error:
+    # (the JSON errors first: the requests JSON errors are IOError-s too,
+    #  the async fetcher raises json.JSONDecodeError, which is a ValueError)
+    except (requests.exceptions.InvalidJSONError, requests.exceptions.JSONDecodeError, ValueError, TypeError) as error:
         print('Wordpress: JSON Error: ', error)
         result['status'] = STS_JSON_ERROR
+    except FETCH_ERRORS as error:
+        print("Wordpress: IO Error: ", error)
+        result['status'] = STS_RESPONSE_ERROR
     except Exception as error:
         print(error)
     finally:
+        record_get_posts(result)
         return result
 
 
+# =========================================================================
+# record_get_posts(get_posts result)
+# =========================================================================
+# - the latency is measured by the fetcher (also for the prefetched entries)
+# =========================================================================
+def record_get_posts(result):
+    metrics.count('get_posts.requests')
+    if result['latency'] is not None:
+        metrics.observe('get_posts.http', result['latency'])
+    if result['status'] == STS_OK:
+        metrics.observe('get_posts.json_decode', result['decode_time'])
+        metrics.count('get_posts.bytes', result['size'])
+    elif result['status'] == STS_NOT_MODIFIED:
+        metrics.count('get_posts.not_modified')
+    else:
+        metrics.count('get_posts.errors')
+
+
 # =========================================================================
 # handle_posts()
 # =========================================================================
-def process_posts(process_parameters):
+@metrics.timed('process_posts')
+def process_posts(process_parameters, entry=None):
     task = process_parameters['task']
     header = process_parameters['header']
 
@@ -130,11 +369,25 @@ def process_posts(process_parameters):
         'total_posts': 0,
         'total_pages': 0,
         # Posts
-        'posts': list()
+        'posts': list(),
+        # Post id-s (only for 'del_check')
+        'ids': list(),
+        # Modification dates (GMT) of the posts by id (only for 'parse')
+        'modified_gmt': dict(),
+        # Size of the response and time of the json decode
+        'size': 0,
+        'decode_time': 0.0,
+        # HTTP status and latency of the GET (None without response)
+        'http_status': None,
+        'latency': None
     }
 
     # get the selected posts (filtered with the parameters)
-    get_posts_result = get_posts(header)
+    get_posts_result = get_posts(header, entry)
+    result['size'] = get_posts_result['size']
+    result['decode_time'] = get_posts_result['decode_time']
+    result['http_status'] = get_posts_result['http_status']
+    result['latency'] = get_posts_result['latency']
     # was the action successful?
 
     # Header data is not available?
@@ -147,32 +400,75 @@ def process_posts(process_parameters):
         result['total_posts'] = get_posts_result['total_posts']
         result['total_pages'] = get_posts_result['total_pages']
 
-        for json_item in get_posts_result['json']:
-            # parse the json object and count the words
-            # - if the caller thread needs it, return an empty word-list otherwise
-            parse_result = {'words': None}
-            if task == 'parse':
-                parse_result = parser.parse_json(json_item['content']['rendered'])
-            # store the result
-            protocol_data = p_io.ProtocolData(
-                json_item['id'],
-                json_item['title']['rendered'],
-                json_item['date'],
-                json_item['modified'],
-                parse_result['words']
-            )
-
-            # print('+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++')
-            # print(parse_result['content'])
-            # print('+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++')
-
-            result['posts'].append(protocol_data)
+        # Nothing changed since the last GET?
+        # - the posts of the 'parse' tasks are already stored, there is nothing to parse
+        if get_posts_result['status'] == STS_NOT_MODIFIED and task == 'parse':
+            result['state'] = ST_RESULT_OK
+            return result
+
+        json_items = get_posts_result['json']
+
+        # The deletion check needs only the id-s
+        if task == 'del_check':
+            result['ids'] = [json_item['id'] for json_item in json_items]
+
+        # parse the json objects and count the words (in the parser processes)
+        elif task == 'parse':
+            word_lists = [None] * len(json_items)
+            stored_posts = [None] * len(json_items)
+            hashes = [None] * len(json_items)
+            # the stored word-list is reused if the content is not changed,
+            # only the new/changed contents are parsed
+            parse_indexes = list()
+            with metrics.timer('process_posts.hash'):
+                for index, json_item in enumerate(json_items):
+                    hashes[index] = parser.content_hash(json_item['content']['rendered'])
+                    stored_post = p_io.protocol_object.get_post(json_item['id'])
+                    if stored_post is not None and stored_post.content_hash() == hashes[index]:
+                        # the word arrays of the stored post are shared (nothing is allocated)
+                        stored_posts[index] = stored_post
+                    else:
+                        parse_indexes.append(index)
+            metrics.count('process_posts.reused', len(json_items) - len(parse_indexes))
+            metrics.count('process_posts.parsed', len(parse_indexes))
+
+            with metrics.timer('process_posts.parse'):
+                parsed_word_lists = get_parser_pool().parse_many(
+                    [json_items[index]['content']['rendered'] for index in parse_indexes])
+            for index, words in zip(parse_indexes, parsed_word_lists):
+                word_lists[index] = words
+
+            for json_item, words, stored_post, entry_hash in zip(json_items, word_lists, stored_posts, hashes):
+                # store the result
+                protocol_data = p_io.ProtocolData(
+                    json_item['id'],
+                    json_item['title']['rendered'],
+                    json_item['date'],
+                    json_item['modified'],
+                    words,
+                    entry_hash,
+                    words_of=stored_post
+                )
+
+                result['posts'].append(protocol_data)
+                result['modified_gmt'][json_item['id']] = json_item.get('modified_gmt')
+
+        # store the validators for the next (conditional) GET
+        # - the body is needed only by the tasks without parse (the parsed posts are already stored)
+        response_cache.store(header, get_posts_result['validators'], {
+            'total_posts': result['total_posts'],
+            'total_pages': result['total_pages'],
+            'json': get_posts_result['json'] if task != 'parse' else None
+        })
 
         result['state'] = ST_RESULT_OK
         return result
 
     except KeyError as error:
         print(f'Wordpress: error by paring the returned json object! Key: {error} not found!')
+    except Exception as error:
+        # (the result is returned by finally, the page is requested again)
+        print(f'Wordpress: error by processing the posts: {error!r}')
     finally:
         return result
 
@@ -186,11 +482,16 @@ def is_ready():
 
 
 # =========================================================================
-# client(executor, ...)
+# client(executor, ...) -> dict
+# =========================================================================
+# Returns the summary of the loop:
+# {'requests': n, 'changes': n, 'latencies': [sec, ...]}
+# - changes: count of the new/changed/deleted posts
+# - latencies: change-detection latencies (time since the modification) of the new/changed posts
+#   (only after the first full crawl)
 # =========================================================================
 def client(executor):
     global current_page
-    global check_page
     global check_pages
     global pages
     global modified_after
@@ -208,26 +509,62 @@ def client(executor):
 
     # Create the GET-header for the threads:
     # We create two lists:
-    # - [POST_PER_PAGE] * pages        --> For example [3, 3, ... ] with 'pages' elements
+    # - [per_page] * pages             --> For example [3, 3, ... ] with 'pages' elements
     # - range(current_page, pages + 1) --> Range between ['current_page' ... 'pages' + 1]
-    last_page = min(pages + 1, current_page + PAGE_PER_LOOP_LIMIT)
-    headers = headers + list(map(lambda t, pp, p: {'task': t, 'header': f"?per_page={pp}&page={p}" + modified_after},
-                                 ['parse'] * pages, [POST_PER_PAGE] * pages, range(current_page, last_page)))
-
-    # Extra GET to check if a post was deleted:
-    # if the datetime filter is set we need an extra GET in every loop
-    # - without time-date filters (normally just the 1. page in every loop)
+    # (per_page and the GETs per loop are selected by the crawl_controller)
+    per_page = crawl_controller.per_page()
+    last_page = min(pages + 1, current_page + crawl_controller.in_flight())
+    headers = headers + list(map(lambda t, pp, p: {'task': t,
+                                                   'header': task_header(t, f"per_page={pp}&page={p}" + modified_after)},
+                                 ['parse'] * pages, [per_page] * pages, range(current_page, last_page)))
+
+    # Extra GETs to check if a post was deleted:
+    # if the datetime filter is set we need extra GETs in every loop
+    # - without time-date filters, only the id-s (sorted by id) with the maximal page size
+    # - every page parallel (the page count is known from the last check)
     # - without parse
-    # to get the max post count in result_all_posts
+    # to get the max post count in result_all_posts and to find the deleted posts
+    # (these headers are not repeated, the next loop starts a new check anyway)
+    check_headers = list()
     if modified_after != '':
-        headers.append({'task': 'del_check', 'header': f"?per_page={POST_PER_PAGE}&page={check_page}"})
+        check_headers = [{'task': 'del_check',
+                          'header': task_header('del_check', f"orderby=id&order=asc&per_page={CHECK_PER_PAGE}&page={p}")}
+                         for p in range(1, check_pages + 1)]
+    # the id-s stored before the check (only these posts can be deleted by this check)
+    check_known_ids = set(p_io.protocol_object.get_post_ids())
+    check_found_ids = set()
+    check_totals = set()
+    check_total_pages = set()
+    check_complete = True
+
+    loop_headers = headers + check_headers
+    summary = {'requests': len(loop_headers), 'changes': 0, 'latencies': list()}
+    polling = modified_after != ''
 
     print('#########################################################################')
-    print('headers: ', headers)
+    print('headers: ', loop_headers)
     print()
 
-    for result in executor.map(process_posts, headers):
+    if ASYNC_FETCH:
+        # every GET is in flight at the same time, only the results are processed by the threads
+        entries = get_async_fetcher().get_many([URL + h['header'] for h in loop_headers],
+                                               [response_cache.request_headers(h['header']) for h in loop_headers])
+        results = executor.map(process_posts, loop_headers, entries)
+    else:
+        results = executor.map(process_posts, loop_headers)
+
+    for result in results:
         try:
+            # received bytes and json decode time per page
+            task_totals = payload_totals.setdefault(result['parameters']['task'],
+                                                    {'pages': 0, 'bytes': 0, 'decode_time': 0.0})
+            task_totals['pages'] += 1
+            task_totals['bytes'] += result['size']
+            task_totals['decode_time'] += result['decode_time']
+            # latency and response for the page size / GETs per loop
+            crawl_controller.observe(result['latency'], result['http_status'])
+            print(f"page {result['parameters']['header']}: {result['size']} bytes, "
+                  f"json decode {result['decode_time']:.4f}s")
 
             # if GET was successful, we can remove this GET-header from the headers
             if result['state'] >= ST_GLOBAL_HEADER_OK:
@@ -246,31 +583,17 @@ def client(executor):
                 elif result['parameters']['task'] == 'del_check':
                     # store the max amount of posts
                     all_result_posts = result['total_posts']
-                    check_pages = result['total_pages']
-
-                    # test if there is any deleted post...
-                    if all_result_posts < p_io.protocol_object.get_post_count():
-                        # at least one post was deleted!
-                        # we should test every post in our dictionary:
-                        #  - increment check_page in every loop until check_pages reached
-                        #  - mark every post in the dictionary, if we found the same entry in the received posts
-                        #    (comparing the post-id-s)
-                        #  - delete the not marked posts and send a broadcast to inform the clients
-                        if check_page < check_pages:
-                            # mark the received id-s as active
-                            for post_object in result['posts']:
-                                p_io.protocol_object.mark_post_as_active(post_object.id())
-                            # select the next page
-                            check_page = check_page + 1
-                        else:
-                            # every post was checked. delete the inactive posts from our memory-storage
-                            p_io.protocol_object.purge_inactive_posts();
-                            check_page = 1
-                    else:
-                        # set the check to the 1. page again
-                        check_page = 1
+                    check_totals.add(result['total_posts'])
+                    check_total_pages.add(result['total_pages'])
+
+            if result['parameters']['task'] == 'del_check':
+                # collect the received id-s
+                if result['state'] == ST_RESULT_OK:
+                    check_found_ids.update(map(str, result['ids']))
+                else:
+                    check_complete = False
 
-            if result['state'] == ST_RESULT_OK:
+            elif result['state'] == ST_RESULT_OK:
                 # remove the header of the successfully processed post
                 headers.remove(result['parameters'])
 
@@ -297,7 +620,16 @@ def client(executor):
                             print('Wordpress: date conversion error! ', error)
 
                         # Store the fully received result
-                        p_io.protocol_object.append_posts(post_object)
+                        if p_io.protocol_object.append_posts(post_object):
+                            summary['changes'] += 1
+                            # change-detection latency
+                            modified_gmt = result['modified_gmt'].get(post_object.id())
+                            if polling and modified_gmt is not None:
+                                try:
+                                    modify_date_gmt = datetime.strptime(modified_gmt, '%Y-%m-%dT%H:%M:%S')
+                                    summary['latencies'].append((datetime.utcnow() - modify_date_gmt).total_seconds())
+                                except ValueError as error:
+                                    print('Wordpress: date conversion error! ', error)
 
                         post_object.print()
 
@@ -306,6 +638,26 @@ def client(executor):
         except Exception as error:
             print('Wordpress: internal error: ', error)
 
+    # Was every post id received by the del_check?
+    # - every page was received and no post was added/deleted during the check
+    #   (the same total count on every page, the total count is the count of the received id-s)
+    # - delete the posts (stored before the check) without a received id, and inform the clients
+    if check_total_pages:
+        # the page count for the next check
+        check_pages = max(max(check_total_pages), 1)
+    if check_headers and check_complete and len(check_totals) == 1 and len(check_headers) >= check_pages \
+            and len(check_found_ids) == all_result_posts:
+        deleted_ids = check_known_ids - check_found_ids
+        if deleted_ids:
+            # the posts stored during the check remain active too
+            for post_id in set(p_io.protocol_object.get_post_ids()) - deleted_ids:
+                p_io.protocol_object.mark_post_as_active(post_id)
+            summary['changes'] += len(p_io.protocol_object.purge_inactive_posts())
+
+    print('connections    ', fetch_stats())
+    print('response cache ', cache_stats())
+    print('payload        ', payload_stats())
+
     # update the current_page
     current_page = last_page
 
@@ -327,3 +679,16 @@ def client(executor):
         #  TODO   Therefore we filter only with 'modified'.
         #  TODO - If this solution is not correct, this code-part should be updated.
         modified_after = f"&modified_after={latest_modify_date}"
+
+    # Update the page size and the GETs per loop
+    # - by a new page size the page variables are converted, the next page
+    #   starts at (or before) the first not received post (nothing is skipped)
+    if crawl_controller.update():
+        new_per_page = crawl_controller.per_page()
+        current_page = (current_page - 1) * per_page // new_per_page + 1
+        result_pages = max(-(-result_posts // new_per_page), 1)
+        if current_page > 1:
+            pages = result_pages
+    print('crawl          ', crawl_state())
+
+    return summary